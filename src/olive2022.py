@@ -12,30 +12,117 @@ connect over the Sinfonia-created wireguard tunnel with a vnc client.
 __version__ = "0.1.6.post.dev0"
 
 import argparse
+import base64
+import gzip
+import hashlib
+import io
+import json
 import os
+import random
+import re
+import resource
 import socket
+import struct
 import subprocess
 import sys
+import tarfile
 import uuid
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from email.message import Message
+from http.client import HTTPException, HTTPResponse
 from pathlib import Path
-from shutil import copyfileobj, which
+from shutil import copyfileobj, disk_usage, rmtree, which
 from tempfile import TemporaryDirectory
-from time import sleep
-from typing import Callable, Tuple
-from urllib.request import urlopen
+from threading import Condition, Lock
+from time import gmtime, perf_counter, sleep, strftime
+from typing import (
+    IO,
+    Any,
+    BinaryIO,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    NoReturn,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+    cast,
+)
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
 from xml.etree import ElementTree as et
-from zipfile import ZipFile
+from zipfile import ZIP_DEFLATED, ZIP_STORED, BadZipFile, ZipFile, ZipInfo
 
 import yaml
 from sinfonia_tier3 import sinfonia_tier3
 from tqdm import tqdm
-from xdg import xdg_data_dirs, xdg_data_home
+from xdg import xdg_cache_home, xdg_data_dirs, xdg_data_home
 from yarl import URL
 
+try:
+    import zstandard
+
+    HAVE_ZSTANDARD = True
+except ImportError:  # pragma: no cover
+    HAVE_ZSTANDARD = False
+
 DESKTOP_FILE_NAME = "olive2022.desktop"
 NAMESPACE_OLIVEARCHIVE = uuid.UUID("835a9728-a1f7-4d0f-82f8-cd0da8838673")
 SINFONIA_TIER1_URL = "https://cmu.findcloudlet.org"
 
+DOWNLOAD_CONNECTIONS = 4
+DOWNLOAD_SEGMENT_SIZE = 32 * 1024 * 1024
+COPY_BUFSIZE = 1024 * 1024
+PACKAGE_CACHE_SIZE = 50 * 1024**3
+SPARSE_BLOCK_SIZE = 4096
+QEMU_IMG_MAX_COROUTINES = 16
+QCOW2_CLUSTER_BITS = 16
+QCOW2_CLUSTER_SIZE = 1 << QCOW2_CLUSTER_BITS
+QCOW2_COMPRESSION_TYPES = ["zlib", "zstd"]
+QCOW2_HEADER = struct.Struct(">4sIQIIQIIQQIIQQQQII")
+QCOW2_MAGIC = b"QFI\xfb"
+QCOW2_L2_OFFSET_MASK = 0x00FFFFFFFFFFFE00
+QCOW2_OFLAG_COPIED = 1 << 63
+QCOW2_OFLAG_COMPRESSED = 1 << 62
+QCOW2_CSIZE_SHIFT = 62 - (QCOW2_CLUSTER_BITS - 8)
+QCOW2_REFCOUNT_ORDER = 4
+QCOW2_BATCH_CLUSTERS = 16
+QCOW2_WRITERS = ["qemu-img", "native"]
+
+CONTAINERDISK_BUILDERS = ["oci", "docker"]
+CONTAINERDISK_UID = 107
+OCI_MANIFEST_MEDIA_TYPE = "application/vnd.oci.image.manifest.v1+json"
+OCI_CONFIG_MEDIA_TYPE = "application/vnd.oci.image.config.v1+json"
+OCI_LAYER_MEDIA_TYPE = "application/vnd.oci.image.layer.v1.tar"
+LAYER_COMPRESSIONS = ["auto", "none", "gzip", "zstd"]
+LAYER_SAMPLE_COUNT = 16
+LAYER_SAMPLE_SIZE = 1024 * 1024
+LAYER_MIN_SAVINGS = 0.05
+LAYER_FORMATS = ["tar", "estargz"]
+ESTARGZ_CHUNK_SIZE = 4 * 1024 * 1024
+ESTARGZ_HOT_SIZE = 4 * 1024 * 1024
+ESTARGZ_HOT_CHUNK_SIZE = 64 * 1024
+ESTARGZ_TOC_NAME = "stargz.index.json"
+ESTARGZ_TOC_DIGEST = "containerd.io/snapshot/stargz/toc.digest"
+ESTARGZ_UNCOMPRESSED_SIZE = "io.containers.estargz.uncompressed-size"
+REGISTRY_CHUNK_SIZE = 32 * 1024 * 1024
+REGISTRY_RETRIES = 5
+REGISTRY_UPLOADS = 4
+CONVERSION_STATE = "conversion-state.json"
+BENCHMARK_SAMPLE_SIZE = 1024  # MiB
+BENCHMARK_RANDOM_READS = 1000
+
+ZIP_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+ZIP_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+ZIP_DATA_DESCRIPTOR_SIGNATURE = b"PK\x07\x08"
+VMNETX_METADATA = ["vmnetx-package.xml", "domain.xml"]
+VMNETX_UNNAMED = ["", "Virtual Machine"]
+
 
 def vmnetx_url_to_uuid(vmnetx_url: URL) -> uuid.UUID:
     """Canonicalize VMNetX URL and derive Sinfonia backend UUID."""
@@ -102,20 +189,590 @@ def stage2(args: argparse.Namespace) -> int:
     return 1
 
 
-def _fetch_vmnetx(vmnetx_url: URL, tmpdir: Path) -> Path:
-    """Fetch a vmnetx package from the given URL."""
+def _http_request(
+    url: URL, method: str = "GET", headers: Optional[Dict[str, str]] = None
+) -> HTTPResponse:
+    """Send a request and return the (unread) response."""
+    request = Request(str(url), headers=headers or {}, method=method)
+    response: HTTPResponse = urlopen(request)
+    return response
+
+
+class _HTTPRangeReader(io.RawIOBase):
+    """Seekable read-only file object that reads using HTTP range requests."""
+
+    def __init__(self, url: URL) -> None:
+        super().__init__()
+        self.url = url
+        self.position = 0
+
+        with _http_request(url, method="HEAD") as response:
+            self.size = int(response.headers["content-length"])
+            if response.headers.get("accept-ranges", "none") != "bytes":
+                raise OSError(f"{url}: server does not support range requests")
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = offset
+        return self.position
+
+    def readinto(self, buffer: Any) -> int:
+        end = min(self.position + len(buffer), self.size)
+        if end <= self.position:
+            return 0
+
+        headers = {"Range": f"bytes={self.position}-{end - 1}"}
+        with _http_request(self.url, headers=headers) as response:
+            if response.status != 206:
+                raise OSError(f"{self.url}: ignored range request")
+            data = response.read(end - self.position)
+
+        memoryview(buffer)[: len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def _open_remote_zipfile(vmnetx_url: URL) -> ZipFile:
+    """Open a remote vmnetx package, only the parts that are accessed will be
+    fetched, starting with the end of central directory record."""
+    url = vmnetx_url.with_scheme("https")
+    reader = io.BufferedReader(_HTTPRangeReader(url), buffer_size=256 * 1024)
+    return ZipFile(reader)
+
+
+def _fetch_segment(
+    url: URL,
+    vmnetx_package: Path,
+    start: int,
+    end: int,
+    validator: Optional[str],
+    progress: "tqdm[NoReturn]",
+) -> None:
+    """Fetch bytes start..end-1 of url into the same range of vmnetx_package."""
+    headers = {"Range": f"bytes={start}-{end - 1}"}
+    if validator is not None:
+        headers["If-Range"] = validator
+
+    with _http_request(url, headers=headers) as response:
+        if response.status != 206:
+            raise OSError(f"{url}: changed or ignored range request")
+
+        with vmnetx_package.open("r+b") as dst:
+            dst.seek(start)
+            while start < end:
+                data = response.read(min(COPY_BUFSIZE, end - start))
+                if not data:
+                    raise OSError(f"{url}: short read at offset {start}")
+                dst.write(data)
+                start += len(data)
+                progress.update(len(data))
+
+
+class _DownloadCheckpoint:
+    """Tracks completed byte ranges of a partial download on disk."""
+
+    def __init__(self, path: Path, url: URL, total: int, headers: Message) -> None:
+        self.path = path
+        self.state: Dict[str, Any] = dict(
+            url=str(url),
+            size=total,
+            etag=headers.get("etag"),
+            last_modified=headers.get("last-modified"),
+            done=[],
+        )
+        self.lock = Lock()
+
+    @property
+    def validator(self) -> Optional[str]:
+        """Validator to use for conditional range requests (If-Range)."""
+        etag: Optional[str] = self.state["etag"]
+        if etag is not None and not etag.startswith("W/"):
+            return etag
+        last_modified: Optional[str] = self.state["last_modified"]
+        return last_modified
+
+    def resume(self) -> bool:
+        """Load completed ranges if the checkpoint matches the remote file."""
+        try:
+            saved = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return False
+
+        if any(
+            saved.get(key) != self.state[key]
+            for key in ["url", "size", "etag", "last_modified"]
+        ) or (self.state["etag"] is None and self.state["last_modified"] is None):
+            return False
+
+        self.state["done"] = saved.get("done", [])
+        return True
+
+    def completed(self) -> int:
+        """Number of bytes already downloaded."""
+        return sum(end - start for start, end in self.state["done"])
+
+    def missing(self) -> List[Tuple[int, int]]:
+        """Split the ranges that still have to be fetched into segments."""
+        segments = []
+        offset = 0
+        for start, end in sorted(self.state["done"]) + [[self.state["size"]] * 2]:
+            for segment in range(offset, start, DOWNLOAD_SEGMENT_SIZE):
+                segments.append((segment, min(segment + DOWNLOAD_SEGMENT_SIZE, start)))
+            offset = max(offset, end)
+        return segments
+
+    def add(self, start: int, end: int) -> None:
+        """Record a completed range and atomically update the checkpoint file."""
+        with self.lock:
+            merged: List[List[int]] = []
+            for range_ in sorted(self.state["done"] + [[start, end]]):
+                if merged and range_[0] <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], range_[1])
+                else:
+                    merged.append(list(range_))
+            self.state["done"] = merged
+            self.save(self.path)
+
+    def save(self, path: Path) -> None:
+        """Atomically write the current state to path."""
+        tmpfile = path.with_name(path.name + ".tmp")
+        tmpfile.write_text(json.dumps(self.state))
+        tmpfile.replace(path)
+
+
+def _fetch_vmnetx(
+    vmnetx_url: URL,
+    vmnetx_package: Path,
+    connections: int = DOWNLOAD_CONNECTIONS,
+    metadata: Optional[Path] = None,
+    stats: Optional[Dict[str, Any]] = None,
+) -> Path:
+    """Fetch a vmnetx package from the given URL.
+    When the server accepts range requests the package is split in segments
+    which are fetched over several concurrent connections. Progress is kept in
+    a checkpoint next to the partial download so that an interrupted fetch can
+    be resumed as long as the remote file has not changed.
+    When metadata is given, the validators of the fetched package are saved
+    there for later revalidation. The number of bytes that were transferred
+    is recorded in stats.
+    """
+    stats = {} if stats is None else stats
     url = vmnetx_url.with_scheme("https")
-    vmnetx_package = tmpdir / "vmnetx-package.zip"
+    partial = vmnetx_package.with_name(vmnetx_package.name + ".part")
+    checkpoint_path = vmnetx_package.with_name(vmnetx_package.name + ".checkpoint")
+    vmnetx_package.parent.mkdir(parents=True, exist_ok=True)
 
     print("Fetching", url)
-    with urlopen(str(url)) as response:
+    with _http_request(url, method="HEAD") as response:
         total = int(response.headers["content-length"])
-        with tqdm.wrapattr(response, "read", total=total) as src:
-            with vmnetx_package.open("wb") as dst:
-                copyfileobj(src, dst)
+        accept_ranges = response.headers.get("accept-ranges", "none") == "bytes"
+        checkpoint = _DownloadCheckpoint(checkpoint_path, url, total, response.headers)
+
+    if not accept_ranges:
+        with _http_request(url) as response:
+            with tqdm.wrapattr(response, "read", total=total) as src:
+                with partial.open("wb") as dst:
+                    copyfileobj(src, dst, COPY_BUFSIZE)
+        partial.replace(vmnetx_package)
+        if metadata is not None:
+            checkpoint.save(metadata)
+        stats["bytes_read"] = total
+        return vmnetx_package
+
+    if partial.exists() and checkpoint.resume():
+        print("Resuming download")
+        stats["bytes_read"] = total - checkpoint.completed()
+    else:
+        stats["bytes_read"] = total
+        # preallocate so segments can be written in place as they arrive
+        with partial.open("wb") as dst:
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(dst.fileno(), 0, total)
+            else:
+                dst.truncate(total)
+
+    def fetch(segment: Tuple[int, int]) -> None:
+        start, end = segment
+        _fetch_segment(url, partial, start, end, checkpoint.validator, progress)
+        checkpoint.add(start, end)
+
+    with tqdm(
+        total=total,
+        initial=checkpoint.completed(),
+        unit="B",
+        unit_scale=True,
+        unit_divisor=1024,
+    ) as progress:
+        with ThreadPoolExecutor(max_workers=max(connections, 1)) as pool:
+            for _ in pool.map(fetch, checkpoint.missing()):
+                pass
+
+    partial.replace(vmnetx_package)
+    if metadata is not None:
+        checkpoint_path.replace(metadata)
+    else:
+        checkpoint_path.unlink()
     return vmnetx_package
 
 
+class _PackagePins:
+    """Packages in the package cache that are used by running conversions,
+    these are not evicted when another conversion adds a package."""
+
+    def __init__(self) -> None:
+        self.pins: Dict[Path, int] = {}
+        self.lock = Lock()
+
+    def pin(self, package: Path) -> None:
+        with self.lock:
+            self.pins[package] = self.pins.get(package, 0) + 1
+
+    def unpin(self, package: Path) -> None:
+        with self.lock:
+            self.pins[package] -= 1
+            if not self.pins[package]:
+                del self.pins[package]
+
+    def packages(self) -> Set[Path]:
+        with self.lock:
+            return set(self.pins)
+
+
+def _cached_vmnetx_path(sinfonia_uuid: uuid.UUID) -> Path:
+    return xdg_cache_home() / "olive2022" / "packages" / f"{sinfonia_uuid}.zip"
+
+
+def _evict_vmnetx_cache(cache_dir: Path, cache_size: int, keep: Set[Path]) -> None:
+    """Remove least recently used packages until the cache fits in cache_size,
+    packages in keep are not removed."""
+    packages = sorted(
+        (package.stat().st_mtime, package.stat().st_size, package)
+        for package in cache_dir.glob("*.zip")
+    )
+    total = sum(size for _, size, _ in packages)
+
+    for _, size, package in packages:
+        if total <= cache_size:
+            break
+        if package in keep:
+            continue
+        print("Evicting", package.stem, "from package cache")
+        metadata = package.with_suffix(".json")
+        if metadata.exists():
+            metadata.unlink()
+        package.unlink()
+        total -= size
+
+
+def _fetch_cached_vmnetx(
+    vmnetx_url: URL,
+    sinfonia_uuid: uuid.UUID,
+    connections: int = DOWNLOAD_CONNECTIONS,
+    cache_size: int = PACKAGE_CACHE_SIZE,
+    pins: Optional[_PackagePins] = None,
+    stats: Optional[Dict[str, Any]] = None,
+) -> Path:
+    """Fetch a vmnetx package through the local package cache.
+    Cached packages are revalidated with a conditional request and reused
+    without fetching the body when the server reports they are unchanged.
+    Packages pinned by running conversions are not evicted. The number of
+    bytes that were transferred is recorded in stats.
+    """
+    stats = {} if stats is None else stats
+    vmnetx_package = _cached_vmnetx_path(sinfonia_uuid)
+    cache_dir = vmnetx_package.parent
+    metadata = vmnetx_package.with_suffix(".json")
+
+    try:
+        validators = json.loads(metadata.read_text())
+        if vmnetx_package.stat().st_size != validators.get("size"):
+            validators = {}
+    except (OSError, ValueError):
+        validators = {}
+
+    headers = {}
+    if validators.get("etag") is not None:
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified") is not None:
+        headers["If-Modified-Since"] = validators["last_modified"]
+
+    if headers:
+        url = vmnetx_url.with_scheme("https")
+        try:
+            # only the status is needed, the body is never read
+            with _http_request(url, headers=headers):
+                pass
+        except HTTPError as exc:
+            if exc.code != 304:
+                raise
+            print("Using cached package", vmnetx_package)
+            os.utime(vmnetx_package)
+            stats["bytes_read"] = 0
+            return vmnetx_package
+
+    for stale in [metadata, vmnetx_package]:
+        if stale.exists():
+            stale.unlink()
+    _fetch_vmnetx(vmnetx_url, vmnetx_package, connections, metadata, stats)
+    keep = {vmnetx_package} | (pins.packages() if pins is not None else set())
+    _evict_vmnetx_cache(cache_dir, cache_size, keep)
+    return vmnetx_package
+
+
+class _SparseFile:
+    """Write-only file that seeks over all-zero blocks instead of writing them,
+    which leaves holes in the resulting (sparse) file."""
+
+    ZERO_BLOCK = bytes(SPARSE_BLOCK_SIZE)
+    ZERO_CHUNK = bytes(COPY_BUFSIZE)
+    ZERO_PREFIX = bytes(64)
+
+    def __init__(self, path: Path) -> None:
+        self.file = path.open("wb")
+        self.pending = bytearray()
+        self.size = 0
+
+    def __enter__(self) -> "_SparseFile":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def write(self, data: bytes) -> int:
+        self.pending += data
+        if len(self.pending) >= COPY_BUFSIZE:
+            aligned = len(self.pending) - len(self.pending) % SPARSE_BLOCK_SIZE
+            self._write_blocks(self.pending[:aligned])
+            del self.pending[:aligned]
+        return len(data)
+
+    def _write_blocks(self, data: bytearray) -> None:
+        # write runs of non-zero blocks, seek over the zero blocks. Candidate
+        # zero blocks are found with a substring search, so non-zero data is
+        # written without looking at every block
+        view = memoryview(data)
+        run_start = offset = 0
+        while offset < len(data):
+            zeros = data.find(self.ZERO_PREFIX, offset)
+            if zeros == -1:
+                break
+            hole_start = -(-zeros // SPARSE_BLOCK_SIZE) * SPARSE_BLOCK_SIZE
+            hole_end = hole_start
+            while data.startswith(self.ZERO_CHUNK, hole_end):
+                hole_end += COPY_BUFSIZE
+            while data.startswith(self.ZERO_BLOCK, hole_end):
+                hole_end += SPARSE_BLOCK_SIZE
+
+            if hole_end > hole_start:
+                if run_start < hole_start:
+                    self.file.write(view[run_start:hole_start])
+                self.file.seek(hole_end - hole_start, os.SEEK_CUR)
+                run_start = hole_end
+            offset = max(hole_end, hole_start + 1)
+        if run_start < len(data):
+            self.file.write(view[run_start:])
+        view.release()
+        self.size += len(data)
+
+    def close(self) -> None:
+        if self.file.closed:
+            return
+        self._write_blocks(self.pending)
+        self.pending.clear()
+        # extend the file when it ends with a hole
+        self.file.truncate(self.size)
+        self.file.close()
+
+
+def _report_sparse(disk_img: Path) -> None:
+    """Show how much space is allocated for a (sparse) disk image."""
+    stat = disk_img.stat()
+    print(
+        f"disk image allocated {stat.st_blocks * 512 // 1024**2}MiB",
+        f"of {stat.st_size // 1024**2}MiB",
+    )
+
+
+class _StreamReader:
+    """Sequential reader that allows pushing back data that was read ahead."""
+
+    def __init__(self, stream: Any) -> None:
+        self.stream = stream
+        self.pending = b""
+
+    def read(self, size: int = COPY_BUFSIZE) -> bytes:
+        if self.pending:
+            data, self.pending = self.pending[:size], self.pending[size:]
+            return data
+        return cast(bytes, self.stream.read(size))
+
+    def read_exact(self, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = self.read(size - len(data))
+            if not chunk:
+                raise BadZipFile("Truncated vmnetx package")
+            data += chunk
+        return data
+
+    def unread(self, data: bytes) -> None:
+        self.pending = data + self.pending
+
+
+def _stream_zip_member(
+    reader: _StreamReader,
+    compress_type: int,
+    compress_size: Optional[int],
+    dst: Union[BinaryIO, _SparseFile, None],
+) -> Tuple[int, int]:
+    """Decompress a zip member from the stream, returns its crc and size."""
+    crc = size = 0
+
+    if compress_type == ZIP_STORED:
+        if compress_size is None:
+            raise BadZipFile("Unable to stream stored member without size")
+        while size < compress_size:
+            data = reader.read(min(COPY_BUFSIZE, compress_size - size))
+            if not data:
+                raise BadZipFile("Truncated vmnetx package")
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            if dst is not None:
+                dst.write(data)
+
+    elif compress_type == ZIP_DEFLATED:
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        while not decompressor.eof:
+            chunk = decompressor.unconsumed_tail or reader.read()
+            if not chunk:
+                raise BadZipFile("Truncated vmnetx package")
+            # bound the output, a chunk of zeros inflates ~1000x
+            data = decompressor.decompress(chunk, COPY_BUFSIZE)
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            if dst is not None:
+                dst.write(data)
+        reader.unread(decompressor.unused_data)
+
+    else:
+        raise BadZipFile(f"Unsupported compression method {compress_type}")
+
+    return crc, size
+
+
+def _stream_vmnetx(
+    vmnetx_url: URL, tmpdir: Path, stats: Optional[Dict[str, Any]] = None
+) -> Tuple[Dict[str, bytes], Path]:
+    """Fetch a vmnetx package and extract disk.img while it is downloaded.
+    The local file headers are parsed as they arrive and the members are
+    verified against the central directory at the end of the package.
+    Returns the vmnetx metadata files and the path to the extracted disk image,
+    the number of bytes that were transferred is recorded in stats.
+    """
+    stats = {} if stats is None else stats
+    url = vmnetx_url.with_scheme("https")
+    disk_img = tmpdir / "disk.img"
+    metadata: Dict[str, bytes] = {}
+    extracted: Dict[str, Tuple[int, int]] = {}
+
+    print("Streaming", url)
+    with _http_request(url) as response:
+        total = int(response.headers["content-length"])
+        with tqdm.wrapattr(response, "read", total=total) as src:
+            reader = _StreamReader(src)
+
+            while True:
+                signature = reader.read_exact(4)
+                if signature != ZIP_LOCAL_HEADER_SIGNATURE:
+                    break
+
+                (
+                    _,
+                    _,
+                    flags,
+                    compress_type,
+                    _,
+                    _,
+                    _,
+                    compress_size,
+                    _,
+                    filename_length,
+                    extra_length,
+                ) = ZIP_LOCAL_HEADER.unpack(
+                    signature + reader.read_exact(ZIP_LOCAL_HEADER.size - 4)
+                )
+                filename = reader.read_exact(filename_length).decode(
+                    "utf-8" if flags & 0x800 else "cp437"
+                )
+                extra = reader.read_exact(extra_length)
+
+                # zip64 extended information extra field
+                zip64 = False
+                while len(extra) >= 4:
+                    tag, length = struct.unpack("<2H", extra[:4])
+                    if tag == 0x0001 and length >= 16:
+                        zip64 = True
+                        if compress_size == 0xFFFFFFFF:
+                            (compress_size,) = struct.unpack("<Q", extra[12:20])
+                    extra = extra[4 + length :]
+
+                if flags & 0x08 and compress_size == 0:
+                    compress_size = None  # sizes follow in the data descriptor
+
+                if filename == "disk.img":
+                    with _SparseFile(disk_img) as dst:
+                        extracted[filename] = _stream_zip_member(
+                            reader, compress_type, compress_size, dst
+                        )
+                else:
+                    buffer = io.BytesIO()
+                    extracted[filename] = _stream_zip_member(
+                        reader,
+                        compress_type,
+                        compress_size,
+                        buffer if filename in VMNETX_METADATA else None,
+                    )
+                    if filename in VMNETX_METADATA:
+                        metadata[filename] = buffer.getvalue()
+
+                if flags & 0x08:
+                    descriptor = reader.read_exact(4)
+                    if descriptor != ZIP_DATA_DESCRIPTOR_SIGNATURE:
+                        reader.unread(descriptor)
+                    reader.read_exact(20 if zip64 else 12)
+
+            # remainder is the central directory
+            tail = [signature]
+            while True:
+                data = reader.read()
+                if not data:
+                    break
+                tail.append(data)
+
+    with ZipFile(io.BytesIO(b"".join(tail))) as central_directory:
+        for info in central_directory.infolist():
+            if extracted.pop(info.filename, None) != (info.CRC, info.file_size):
+                raise BadZipFile(f"Bad CRC or size for {info.filename}")
+    if extracted:
+        raise BadZipFile(f"Unexpected members {list(extracted)}")
+
+    _report_sparse(disk_img)
+    stats["bytes_read"] = total
+    return metadata, disk_img
+
+
 def _parse_vmnetx_package_xml(vmnetx_package_xml: bytes) -> str:
     """Extract the virtual machine name from vmnetx-package.xml.
     This is normally added by Olivearchive based on the archive meta-data.
@@ -124,7 +781,7 @@ def _parse_vmnetx_package_xml(vmnetx_package_xml: bytes) -> str:
     package_description = et.XML(vmnetx_package_xml)
     vmi_fullname = package_description.attrib["name"]
 
-    while vmi_fullname in ["", "Virtual Machine"]:
+    while vmi_fullname in VMNETX_UNNAMED:
         vmi_fullname = input("VM image name: ")
 
     return vmi_fullname
@@ -138,28 +795,521 @@ def _parse_domain_xml(domain_xml: bytes) -> Tuple[int, int]:
     return cpus, memory
 
 
-def _recompress_disk(disk_img: Path, tmpdir: Path) -> Path:
-    """Recompress disk.img to disk.qcow."""
+def inspect(args: argparse.Namespace) -> int:
+    """Show VMNetX package metadata without fetching the whole package."""
+    sinfonia_uuid = vmnetx_url_to_uuid(args.url)
+
+    with (
+        _open_remote_zipfile(args.url)
+        if args.vmnetx_package is None
+        else ZipFile(args.vmnetx_package)
+    ) as zipfile:
+        package_description = et.XML(zipfile.read("vmnetx-package.xml"))
+        cpus, memory = _parse_domain_xml(zipfile.read("domain.xml"))
+        disk_img = zipfile.getinfo("disk.img")
+
+    info = dict(
+        uuid=str(sinfonia_uuid),
+        name=package_description.attrib["name"],
+        cpus=cpus,
+        memory=memory,
+        disk_compressed_size=disk_img.compress_size,
+        disk_size=disk_img.file_size,
+    )
+
+    if args.json:
+        print(json.dumps(info))
+    else:
+        print("UUID:", info["uuid"])
+        print(info["name"])
+        print("cpus", cpus, "memory", memory)
+        print(
+            "disk.img",
+            f"{disk_img.compress_size / 1024**2:.0f}MiB compressed",
+            f"{disk_img.file_size / 1024**2:.0f}MiB uncompressed",
+        )
+    return 0
+
+
+def _extract_sparse(zipfile: ZipFile, zipinfo: ZipInfo, disk_img: Path) -> Path:
+    """Extract a zip member as a sparse file."""
+    with zipfile.open(zipinfo) as src, _SparseFile(disk_img) as dst:
+        copyfileobj(src, dst, COPY_BUFSIZE)
+    _report_sparse(disk_img)
+    return disk_img
+
+
+def _zip_member_view(vmnetx_package: Path, zipinfo: ZipInfo) -> Optional[str]:
+    """Describe a stored (uncompressed) zip member as a qemu block device that
+    reads the member data in place. Returns None for compressed members."""
+    if zipinfo.compress_type != ZIP_STORED:
+        return None
+
+    with vmnetx_package.open("rb") as package:
+        package.seek(zipinfo.header_offset)
+        header = ZIP_LOCAL_HEADER.unpack(package.read(ZIP_LOCAL_HEADER.size))
+        if header[0] != ZIP_LOCAL_HEADER_SIGNATURE:
+            raise BadZipFile(f"Bad local file header for {zipinfo.filename}")
+
+        offset = zipinfo.header_offset + ZIP_LOCAL_HEADER.size + header[9] + header[10]
+        package.seek(offset)
+        magic = package.read(4)
+
+    view: Dict[str, Any] = dict(
+        driver="raw",
+        offset=offset,
+        size=zipinfo.file_size,
+        file=dict(driver="file", filename=str(vmnetx_package.resolve())),
+    )
+    if magic == QCOW2_MAGIC:
+        view = dict(driver="qcow2", file=view)
+    return "json:" + json.dumps(view)
+
+
+class _Qcow2Writer:
+    """Minimal writer for compressed qcow2 (version 3) images.
+    Clusters are appended in the order they are passed in, compressed clusters
+    are packed back to back. The L2 tables, L1 table and refcount structures
+    are appended when the image is closed, after which the header is written.
+    """
+
+    def __init__(self, path: Path, size: int) -> None:
+        self.file = path.open("wb")
+        self.size = size
+        self.l2_entries = QCOW2_CLUSTER_SIZE // 8
+        self.l2_tables: Dict[int, List[int]] = {}
+        self.refcounts: List[int] = []
+        self.stats = dict(compressed_clusters=0, uncompressed_clusters=0)
+
+        # cluster 0 holds the header which is written last
+        self.offset = QCOW2_CLUSTER_SIZE
+        self.file.seek(self.offset)
+        self._ref(0, QCOW2_CLUSTER_SIZE)
+
+    def __enter__(self) -> "_Qcow2Writer":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.file.close()
+
+    def _ref(self, offset: int, length: int) -> None:
+        """Increment refcounts of the host clusters covering offset+length."""
+        first = offset >> QCOW2_CLUSTER_BITS
+        last = (offset + length - 1) >> QCOW2_CLUSTER_BITS
+        if len(self.refcounts) <= last:
+            self.refcounts.extend([0] * (last + 1 - len(self.refcounts)))
+        for cluster in range(first, last + 1):
+            self.refcounts[cluster] += 1
+
+    def _align(self) -> None:
+        self.offset += -self.offset % QCOW2_CLUSTER_SIZE
+        self.file.seek(self.offset)
+
+    def _append(self, data: bytes) -> int:
+        """Append data at the current offset, returns the offset."""
+        offset = self.offset
+        self.file.write(data)
+        self._ref(offset, len(data))
+        self.offset += len(data)
+        return offset
+
+    def _append_table(self, entries: List[int]) -> int:
+        """Append a cluster aligned table of 64-bit entries."""
+        self._align()
+        entries = entries + [0] * (-len(entries) % self.l2_entries)
+        return self._append(struct.pack(f">{len(entries)}Q", *entries))
+
+    def write_cluster(self, index: int, data: bytes) -> None:
+        """Write guest cluster index, data is either deflated or a full cluster.
+        Clusters that are not written read as zeros.
+        """
+        if len(data) < QCOW2_CLUSTER_SIZE:
+            sectors = ((self.offset + len(data) - 1) >> 9) - (self.offset >> 9)
+            entry = QCOW2_OFLAG_COMPRESSED | sectors << QCOW2_CSIZE_SHIFT
+            self.stats["compressed_clusters"] += 1
+        else:
+            self._align()
+            entry = QCOW2_OFLAG_COPIED
+            self.stats["uncompressed_clusters"] += 1
+
+        entry |= self._append(data)
+
+        l1_index, l2_index = divmod(index, self.l2_entries)
+        l2_table = self.l2_tables.setdefault(l1_index, [0] * self.l2_entries)
+        l2_table[l2_index] = entry
+
+    def close(self) -> None:
+        """Write image metadata and header."""
+        guest_clusters = -(-self.size // QCOW2_CLUSTER_SIZE)
+        l1_table = [0] * -(-guest_clusters // self.l2_entries)
+        for l1_index, l2_table in sorted(self.l2_tables.items()):
+            l1_table[l1_index] = QCOW2_OFLAG_COPIED | self._append_table(l2_table)
+        l1_table_offset = self._append_table(l1_table)
+
+        # the refcount blocks and table have to account for themselves
+        self._align()
+        first_cluster = self.offset >> QCOW2_CLUSTER_BITS
+        refcount_block_entries = QCOW2_CLUSTER_SIZE * 8 >> QCOW2_REFCOUNT_ORDER
+        blocks = table_clusters = 0
+        while True:
+            clusters = first_cluster + blocks + table_clusters
+            needed_blocks = -(-clusters // refcount_block_entries)
+            needed_table_clusters = -(-needed_blocks * 8 // QCOW2_CLUSTER_SIZE)
+            if (blocks, table_clusters) == (needed_blocks, needed_table_clusters):
+                break
+            blocks, table_clusters = needed_blocks, needed_table_clusters
+        self._ref(self.offset, (blocks + table_clusters) * QCOW2_CLUSTER_SIZE)
+
+        refcounts = self.refcounts
+        refcounts += [0] * (blocks * refcount_block_entries - len(refcounts))
+        refcount_table = []
+        for block in range(blocks):
+            refcount_table.append(self.offset)
+            start = block * refcount_block_entries
+            entries = refcounts[start : start + refcount_block_entries]
+            self.file.write(struct.pack(f">{refcount_block_entries}H", *entries))
+            self.offset += QCOW2_CLUSTER_SIZE
+        refcount_table += [0] * (table_clusters * self.l2_entries - blocks)
+        refcount_table_offset = self.offset
+        self.file.write(struct.pack(f">{len(refcount_table)}Q", *refcount_table))
+
+        self.file.seek(0)
+        self.file.write(
+            QCOW2_HEADER.pack(
+                QCOW2_MAGIC,
+                3,  # version
+                0,  # backing_file_offset
+                0,  # backing_file_size
+                QCOW2_CLUSTER_BITS,
+                self.size,
+                0,  # crypt_method
+                len(l1_table),
+                l1_table_offset,
+                refcount_table_offset,
+                table_clusters,
+                0,  # nb_snapshots
+                0,  # snapshots_offset
+                0,  # incompatible_features
+                0,  # compatible_features
+                0,  # autoclear_features
+                QCOW2_REFCOUNT_ORDER,
+                QCOW2_HEADER.size,
+            )
+        )
+        # end of header extensions
+        self.file.write(bytes(8))
+        self.file.close()
+
+
+def _compress_clusters(data: bytes) -> List[Optional[bytes]]:
+    """Compress a batch of clusters for qcow2. All-zero clusters are returned
+    as None and clusters that do not compress are returned unmodified."""
+    zero_cluster = bytes(QCOW2_CLUSTER_SIZE)
+    clusters: List[Optional[bytes]] = []
+    for offset in range(0, len(data), QCOW2_CLUSTER_SIZE):
+        cluster = data[offset : offset + QCOW2_CLUSTER_SIZE]
+        if cluster == zero_cluster:
+            clusters.append(None)
+            continue
+        # qemu inflates compressed clusters with a 4KiB window
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -12, 9)
+        compressed = compressor.compress(cluster) + compressor.flush()
+        clusters.append(compressed if len(compressed) < len(cluster) else cluster)
+    return clusters
+
+
+def _write_qcow2(
+    src: IO[bytes], size: int, disk_qcow: Path, threads: int
+) -> Dict[str, int]:
+    """Write a compressed qcow2 image from a raw disk image stream.
+    Clusters are compressed in batches on a thread pool (zlib releases the
+    GIL) and written in order, the number of batches in flight is bounded.
+    """
+    batch_size = QCOW2_BATCH_CLUSTERS * QCOW2_CLUSTER_SIZE
+    pending: Deque[Tuple[int, "Future[List[Optional[bytes]]]"]] = deque()
+    zero_clusters = 0
+
+    with _Qcow2Writer(disk_qcow, size) as writer:
+
+        def drain(limit: int) -> None:
+            nonlocal zero_clusters
+            while len(pending) > limit:
+                index, future = pending.popleft()
+                for cluster_index, cluster in enumerate(future.result(), index):
+                    if cluster is None:
+                        zero_clusters += 1
+                    else:
+                        writer.write_cluster(cluster_index, cluster)
+
+        with tqdm(
+            total=size, unit="B", unit_scale=True, unit_divisor=1024
+        ) as progress, ThreadPoolExecutor(max_workers=threads) as pool:
+            for offset in range(0, size, batch_size):
+                length = min(batch_size, size - offset)
+                data = src.read(length)
+                while len(data) < length:
+                    chunk = src.read(length - len(data))
+                    if not chunk:
+                        raise OSError(f"Unexpected end of disk image at {offset}")
+                    data += chunk
+                progress.update(length)
+
+                data += bytes(-length % QCOW2_CLUSTER_SIZE)
+                future = pool.submit(_compress_clusters, data)
+                pending.append((offset // QCOW2_CLUSTER_SIZE, future))
+                drain(2 * threads)
+            drain(0)
+
+        writer.close()
+        return dict(writer.stats, zero_clusters=zero_clusters)
+
+
+def _open_raw_disk(disk_img: str) -> Optional[BinaryIO]:
+    """Open a raw disk image described by a qemu-img filename.
+    Returns a file positioned at the start of the image data, or None when
+    the image is not a raw image.
+    """
+    if disk_img.startswith("json:"):
+        node = json.loads(disk_img[5:])
+        if node["driver"] != "raw" or node["file"]["driver"] != "file":
+            return None
+        raw_disk = open(node["file"]["filename"], "rb")
+        raw_disk.seek(node.get("offset", 0))
+        return raw_disk
+
+    raw_disk = open(disk_img, "rb")
+    if raw_disk.read(4) == QCOW2_MAGIC:
+        raw_disk.close()
+        return None
+    raw_disk.seek(0)
+    return raw_disk
+
+
+def _qemu_img_coroutines(value: str) -> int:
+    """Parse number of qemu-img coroutines, 'auto' scales with the cpu count."""
+    if value == "auto":
+        return min(QEMU_IMG_MAX_COROUTINES, os.cpu_count() or 1)
+    coroutines = int(value)
+    if not 1 <= coroutines <= QEMU_IMG_MAX_COROUTINES:
+        raise argparse.ArgumentTypeError(
+            f"number of coroutines must be between 1 and {QEMU_IMG_MAX_COROUTINES}"
+        )
+    return coroutines
+
+
+def _use_native_writer(args: argparse.Namespace) -> bool:
+    """Check if the native qcow2 writer can produce the requested image, it
+    only writes zlib compressed images with default creation options."""
+    return (
+        args.qcow2_writer == "native"
+        and args.compression_type == "zlib"
+        and not args.qcow2_options
+    )
+
+
+def _extracts_disk(
+    args: argparse.Namespace, disk_info: ZipInfo, disk_member_is_raw: bool
+) -> bool:
+    """Check if disk.img has to be extracted before it is recompressed. A
+    stored disk image is converted in place and the native writer inflates a
+    raw disk image straight from the package."""
+    if disk_info.compress_type == ZIP_STORED:
+        return False
+    return bool(
+        args.benchmark_codecs or not _use_native_writer(args) or not disk_member_is_raw
+    )
+
+
+def _native_recompress(
+    args: argparse.Namespace,
+    raw_disk: IO[bytes],
+    disk_size: int,
+    tmpdir: Path,
+    report: Dict[str, Any],
+) -> Path:
+    """Recompress a raw disk image stream to disk.qcow2 with the native writer.
+    The stream is consumed sequentially, so it can be a zip member that is
+    inflated on the fly, buffering is bounded by the number of threads.
+    """
     disk_qcow = tmpdir / "disk.qcow2"
+
+    start = perf_counter()
+    stats = _write_qcow2(raw_disk, disk_size, disk_qcow, args.threads)
+    elapsed = perf_counter() - start
+
+    qcow2_size = disk_qcow.stat().st_size
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(f"compression savings {100 - 100 * qcow2_size // disk_size}%")
+    print(f"peak memory {peak_rss // 1024**2}MiB")
+
+    report["recompress"] = dict(
+        writer="native",
+        threads=args.threads,
+        compression_type="zlib",
+        disk_size=disk_size,
+        qcow2_size=qcow2_size,
+        seconds=round(elapsed, 3),
+        peak_rss=peak_rss,
+        **stats,
+    )
+    return disk_qcow
+
+
+def _recompress_disk(
+    args: argparse.Namespace,
+    disk_img: str,
+    disk_size: int,
+    tmpdir: Path,
+    report: Dict[str, Any],
+) -> Path:
+    """Recompress disk.img to disk.qcow.
+    disk_img is anything qemu-img accepts as a filename, this may be a json
+    description of a disk image stored inside of the vmnetx package.
+    """
+    disk_qcow = tmpdir / "disk.qcow2"
+
+    if _use_native_writer(args):
+        raw_disk = _open_raw_disk(disk_img)
+        if raw_disk is not None:
+            with raw_disk:
+                return _native_recompress(args, raw_disk, disk_size, tmpdir, report)
+        print("Image not supported by native qcow2 writer, using qemu-img")
+
+    # out of order writes (-W) can not be combined with compressed output
+    options = ["-m", str(args.qemu_img_coroutines)]
+
+    qcow2_options = args.qcow2_options
+    if args.compression_type != "zlib":
+        qcow2_options = ",".join(
+            filter(None, [qcow2_options, f"compression_type={args.compression_type}"])
+        )
+    if qcow2_options:
+        options.extend(["-o", qcow2_options])
+
     subprocess.run(
-        [
-            "qemu-img",
-            "convert",
-            "-c",
-            "-p",
-            "-O",
-            "qcow2",
-            str(disk_img.resolve()),
-            str(disk_qcow.resolve()),
-        ],
+        ["qemu-img", "convert", "-c", "-p", "-O", "qcow2"]
+        + options
+        + [disk_img, str(disk_qcow.resolve())],
         check=True,
     )
-    compression = 100 - 100 * disk_qcow.stat().st_size // disk_img.stat().st_size
+    compression = 100 - 100 * disk_qcow.stat().st_size // disk_size
     if compression != 0:
         print(f"compression savings {compression}%")
+
+    report["recompress"] = dict(
+        writer="qemu-img",
+        coroutines=args.qemu_img_coroutines,
+        qcow2_options=qcow2_options,
+        compression_type=args.compression_type,
+        disk_size=disk_size,
+        qcow2_size=disk_qcow.stat().st_size,
+    )
     return disk_qcow
 
 
+def _qemu_img_sample(disk_img: str, size: int) -> str:
+    """Describe the first size bytes of a disk image as a qemu block device."""
+    if disk_img.startswith("json:"):
+        node = json.loads(disk_img[5:])
+    else:
+        with open(disk_img, "rb") as image:
+            magic = image.read(4)
+        node = dict(driver="file", filename=disk_img)
+        if magic == QCOW2_MAGIC:
+            node = dict(driver="qcow2", file=node)
+    return "json:" + json.dumps(dict(driver="raw", offset=0, size=size, file=node))
+
+
+def _benchmark_codecs(
+    args: argparse.Namespace,
+    disk_img: str,
+    disk_size: int,
+    tmpdir: Path,
+    report: Dict[str, Any],
+) -> None:
+    """Compare qcow2 compression types on a sample of the disk image.
+    Measures compression time and resulting size, as well as the time for
+    sequential and random cluster sized reads of the compressed image.
+    """
+    sample_size = min(disk_size, args.benchmark_sample * 1024**2)
+    sample_size -= sample_size % QCOW2_CLUSTER_SIZE
+    sample = _qemu_img_sample(disk_img, sample_size)
+
+    clusters = sample_size // QCOW2_CLUSTER_SIZE
+    rng = random.Random(0)
+    random_reads = [
+        arg
+        for _ in range(BENCHMARK_RANDOM_READS)
+        for arg in [
+            "-c",
+            f"read -q {rng.randrange(clusters) * QCOW2_CLUSTER_SIZE} "
+            f"{QCOW2_CLUSTER_SIZE}",
+        ]
+    ]
+
+    results = {}
+    for compression_type in QCOW2_COMPRESSION_TYPES:
+        disk_qcow = str((tmpdir / f"benchmark-{compression_type}.qcow2").resolve())
+        print("Benchmarking", compression_type)
+
+        start = perf_counter()
+        subprocess.run(
+            ["qemu-img", "convert", "-c", "-O", "qcow2"]
+            + ["-m", str(args.qemu_img_coroutines)]
+            + ["-o", f"compression_type={compression_type}", sample, disk_qcow],
+            check=True,
+        )
+        compress_time = perf_counter() - start
+
+        start = perf_counter()
+        subprocess.run(
+            ["qemu-img", "bench", "-f", "qcow2", "-d", "1"]
+            + ["-c", str(clusters), "-s", str(QCOW2_CLUSTER_SIZE), disk_qcow],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        sequential_time = perf_counter() - start
+
+        start = perf_counter()
+        subprocess.run(
+            ["qemu-io", "-r", "-f", "qcow2"] + random_reads + [disk_qcow],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        random_time = perf_counter() - start
+
+        results[compression_type] = dict(
+            qcow2_size=Path(disk_qcow).stat().st_size,
+            compress_seconds=round(compress_time, 3),
+            sequential_read_seconds=round(sequential_time, 3),
+            random_read_seconds=round(random_time, 3),
+        )
+        Path(disk_qcow).unlink()
+
+    print(f"sample {sample_size // 1024**2}MiB, {BENCHMARK_RANDOM_READS} random reads")
+    print("codec  size(MiB)  compress(s)  sequential(s)  random(s)")
+    for compression_type, result in results.items():
+        print(
+            f"{compression_type:5}",
+            f"{result['qcow2_size'] // 1024**2:10}",
+            f"{result['compress_seconds']:12.2f}",
+            f"{result['sequential_read_seconds']:14.2f}",
+            f"{result['random_read_seconds']:10.2f}",
+        )
+
+    report["codec_benchmark"] = dict(
+        sample_size=sample_size,
+        random_reads=BENCHMARK_RANDOM_READS,
+        results=results,
+    )
+
+
+def _source_date_epoch() -> int:
+    """Timestamp for files in the containerDisk image, so that converting the
+    same package again results in an identical image."""
+    return int(os.environ.get("SOURCE_DATE_EPOCH", 0))
+
+
 def _create_containerdisk(
     args: argparse.Namespace, tmpdir: Path, vmi_fullname: str, sinfonia_uuid: uuid.UUID
 ) -> str:
@@ -182,8 +1332,19 @@ LABEL org.opencontainers.image.url="https://olivearchive.org" \
 ADD --chown=107:107 disk.qcow2 /disk/
 """
     )
+    source_date_epoch = _source_date_epoch()
+    os.utime(tmpdir / "disk.qcow2", (source_date_epoch, source_date_epoch))
     subprocess.run(
-        ["docker", "build", "-t", docker_tag, str(tmpdir.resolve())], check=True
+        [
+            "docker",
+            "build",
+            "--build-arg",
+            f"SOURCE_DATE_EPOCH={source_date_epoch}",
+            "-t",
+            docker_tag,
+            str(tmpdir.resolve()),
+        ],
+        check=True,
     )
 
     if args.tmp_dir is None:
@@ -193,19 +1354,919 @@ ADD --chown=107:107 disk.qcow2 /disk/
     return docker_tag
 
 
-def _publish_containerdisk(args: argparse.Namespace, docker_tag: str) -> None:
-    if args.deploy_token is None and not input(
-        "Ok to push non-restricted image? [yes/no] "
-    ).lower().startswith("yes"):
-        sys.exit()
+class _HashingWriter:
+    """Write-only file wrapper that computes the sha256 digest of the data."""
 
-    # upload container
-    print("Publishing containerDisk image")
-    subprocess.run(["docker", "push", docker_tag], check=True)
+    def __init__(self, file: BinaryIO) -> None:
+        self.file = file
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.hash.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    @property
+    def digest(self) -> str:
+        return f"sha256:{self.hash.hexdigest()}"
+
+
+class _HashingReader:
+    """Read-only file wrapper that computes the sha256 digest of the data."""
+
+    def __init__(self, file: BinaryIO) -> None:
+        self.file = file
+        self.hash = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.file.read(size)
+        self.hash.update(data)
+        return data
+
+    @property
+    def digest(self) -> str:
+        return f"sha256:{self.hash.hexdigest()}"
+
+
+def _oci_write_blob(oci_layout: Path, media_type: str, data: bytes) -> Dict[str, Any]:
+    """Add a blob to an OCI image layout and return its descriptor."""
+    digest = hashlib.sha256(data).hexdigest()
+    (oci_layout / "blobs" / "sha256" / digest).write_bytes(data)
+    return dict(mediaType=media_type, digest=f"sha256:{digest}", size=len(data))
+
+
+def _layer_compression_option(value: str) -> str:
+    """Check that the requested layer compression is available."""
+    if value == "zstd" and not HAVE_ZSTANDARD:
+        raise argparse.ArgumentTypeError(
+            "zstd layer compression requires the zstandard package, "
+            "install olive2022[zstd]"
+        )
+    return value
+
+
+def _layer_compression(
+    args: argparse.Namespace, disk_qcow: Path, report: Dict[str, Any]
+) -> str:
+    """Pick a layer compression by compressing samples spread over the disk.
+    The qcow2 image is usually compressed already, in which case compressing
+    the layer again only costs time when pushing and pulling the image.
+    """
+    size = disk_qcow.stat().st_size
+    with disk_qcow.open("rb") as src:
+        if size <= LAYER_SAMPLE_COUNT * LAYER_SAMPLE_SIZE:
+            sample = src.read()
+        else:
+            samples = []
+            for i in range(LAYER_SAMPLE_COUNT):
+                src.seek(i * (size - LAYER_SAMPLE_SIZE) // LAYER_SAMPLE_COUNT)
+                samples.append(src.read(LAYER_SAMPLE_SIZE))
+            sample = b"".join(samples)
+
+    ratios = {"gzip": len(zlib.compress(sample, 6)) / max(len(sample), 1)}
+    if HAVE_ZSTANDARD:
+        compressed = zstandard.ZstdCompressor().compress(sample)
+        ratios["zstd"] = len(compressed) / max(len(sample), 1)
+
+    compression = str(args.layer_compression)
+    if compression == "auto":
+        best = min(ratios, key=lambda codec: ratios[codec])
+        compression = best if ratios[best] <= 1 - LAYER_MIN_SAVINGS else "none"
+
+    report["layer_compression"] = dict(
+        policy=args.layer_compression,
+        compression=compression,
+        sample_bytes=len(sample),
+        sample_ratios=ratios,
+    )
+    return compression
+
+
+def _oci_write_layer(
+    oci_layout: Path, disk_qcow: Path, compression: str
+) -> Tuple[Dict[str, Any], str, str]:
+    """Add a layer with /disk/disk.qcow2 to an OCI image layout.
+    The disk image is hashed as it is read and the tar stream is compressed
+    and hashed while it is written, so the multi-gigabyte disk image is only
+    read once. Returns the layer descriptor, the digest of the uncompressed
+    layer (diff_id) and the digest of the disk image.
+    """
+    blobs = oci_layout / "blobs" / "sha256"
+    mtime = _source_date_epoch()
+
+    layer = blobs / "layer.tmp"
+    with layer.open("wb") as blob:
+        writer = _HashingWriter(blob)
+        stream: Any = writer
+        if compression == "gzip":
+            stream = gzip.GzipFile(
+                fileobj=cast(BinaryIO, writer), mode="wb", compresslevel=6, mtime=0
+            )
+        elif compression == "zstd":
+            stream = zstandard.ZstdCompressor(threads=-1).stream_writer(
+                cast(IO[bytes], writer), closefd=False
+            )
+        diff = _HashingWriter(stream)
+
+        with tarfile.open(
+            fileobj=cast(BinaryIO, diff),
+            mode="w|",
+            format=tarfile.PAX_FORMAT,
+            bufsize=COPY_BUFSIZE,
+        ) as tar:
+            disk_dir = tarfile.TarInfo("disk")
+            disk_dir.type = tarfile.DIRTYPE
+            disk_dir.mode = 0o755
+            disk_dir.uid = disk_dir.gid = CONTAINERDISK_UID
+            disk_dir.mtime = mtime
+            tar.addfile(disk_dir)
+
+            disk_file = tarfile.TarInfo("disk/disk.qcow2")
+            disk_file.size = disk_qcow.stat().st_size
+            disk_file.mode = 0o644
+            disk_file.uid = disk_file.gid = CONTAINERDISK_UID
+            disk_file.mtime = mtime
+            with disk_qcow.open("rb") as src:
+                disk = _HashingReader(src)
+                tar.addfile(disk_file, cast(BinaryIO, disk))
+
+        if stream is not writer:
+            stream.close()
+
+    media_type = OCI_LAYER_MEDIA_TYPE
+    if compression != "none":
+        media_type += f"+{compression}"
+
+    layer.replace(blobs / writer.digest.split(":", 1)[1])
+    return (
+        dict(mediaType=media_type, digest=writer.digest, size=writer.size),
+        diff.digest,
+        disk.digest,
+    )
+
+
+def _estargz_chunks(disk_qcow: Path) -> List[Tuple[int, int]]:
+    """Split the disk image in (offset, length) chunks for an eStargz layer.
+    The qcow2 header, the first clusters and the L1 and L2 tables are read
+    when the VM boots, these are split in small chunks so that a lazy pull
+    does not have to fetch much more than what is used.
+    """
+    size = disk_qcow.stat().st_size
+    hot = [(0, ESTARGZ_HOT_SIZE)]
+    with disk_qcow.open("rb") as src:
+        header = src.read(QCOW2_HEADER.size)
+        if len(header) == QCOW2_HEADER.size and header[:4] == QCOW2_MAGIC:
+            fields = QCOW2_HEADER.unpack(header)
+            cluster_size = 1 << fields[4]
+            l1_size, l1_table_offset = fields[7:9]
+            hot.append((l1_table_offset, l1_size * 8))
+            src.seek(l1_table_offset)
+            l1_table = struct.unpack(f">{l1_size}Q", src.read(l1_size * 8))
+            hot.extend(
+                (entry & QCOW2_L2_OFFSET_MASK, cluster_size)
+                for entry in l1_table
+                if entry & QCOW2_L2_OFFSET_MASK
+            )
+
+    chunks = []
+    offset = 0
+    for start, length in sorted(hot) + [(size, 0)]:
+        start = min(max(start, offset), size)
+        end = min(start + length, size)
+        while offset < start:
+            chunks.append((offset, min(ESTARGZ_CHUNK_SIZE, start - offset)))
+            offset += chunks[-1][1]
+        while offset < end:
+            chunks.append((offset, min(ESTARGZ_HOT_CHUNK_SIZE, end - offset)))
+            offset += chunks[-1][1]
+    return chunks
+
+
+def _gzip_member(data: bytes) -> bytes:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _estargz_footer(toc_offset: int) -> bytes:
+    """Empty gzip member with the offset of the table of contents in the
+    extra field, as written by the eStargz reference implementation."""
+    subfield = f"{toc_offset:016x}STARGZ".encode()
+    extra = b"SG" + struct.pack("<H", len(subfield)) + subfield
+    return (
+        b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff"
+        + struct.pack("<H", len(extra))
+        + extra
+        + b"\x01\x00\x00\xff\xff"
+        + bytes(8)
+    )
+
+
+def _oci_write_estargz_layer(
+    oci_layout: Path, disk_qcow: Path, threads: int
+) -> Tuple[Dict[str, Any], str, str]:
+    """Add a layer with /disk/disk.qcow2 in eStargz format to an OCI image
+    layout. Every chunk of the disk image is compressed as a separate gzip
+    member and a table of contents at the end of the layer lists the member
+    offsets, so that a lazy-pulling snapshotter can start the VM after
+    fetching only the chunks that are read. The layer is still a valid
+    gzip compressed tar for runtimes that do not support lazy pulling.
+    Returns the layer descriptor, the digest of the uncompressed layer
+    (diff_id) and the digest of the disk image.
+    """
+    blobs = oci_layout / "blobs" / "sha256"
+    stat = disk_qcow.stat()
+    mtime = _source_date_epoch()
+    owner = dict(
+        modtime=strftime("%Y-%m-%dT%H:%M:%SZ", gmtime(mtime)),
+        uid=CONTAINERDISK_UID,
+        gid=CONTAINERDISK_UID,
+    )
+
+    disk_dir = tarfile.TarInfo("disk")
+    disk_dir.type = tarfile.DIRTYPE
+    disk_dir.mode = 0o755
+    disk_dir.uid = disk_dir.gid = CONTAINERDISK_UID
+    disk_dir.mtime = mtime
+
+    disk_file = tarfile.TarInfo("disk/disk.qcow2")
+    disk_file.size = stat.st_size
+    disk_file.mode = 0o644
+    disk_file.uid = disk_file.gid = CONTAINERDISK_UID
+    disk_file.mtime = mtime
+
+    chunks = _estargz_chunks(disk_qcow)
+    file_entry: Dict[str, Any] = dict(
+        name=disk_file.name, type="reg", size=disk_file.size, mode=0o644, **owner
+    )
+    toc: List[Dict[str, Any]] = [
+        dict(name="disk/", type="dir", mode=0o755, **owner),
+    ]
+    file_hash = hashlib.sha256()
+    diff = hashlib.sha256()
+    diff_size = 0
+
+    layer = blobs / "layer.tmp"
+    with layer.open("wb") as blob:
+        writer = _HashingWriter(blob)
+        pending: Deque[Tuple[Optional[Dict[str, Any]], bytes, "Future[bytes]"]]
+        pending = deque()
+
+        def drain(limit: int) -> None:
+            nonlocal diff_size
+            while len(pending) > limit:
+                entry, data, future = pending.popleft()
+                if entry is not None:
+                    entry["offset"] = writer.size
+                diff.update(data)
+                diff_size += len(data)
+                writer.write(future.result())
+
+        with ThreadPoolExecutor(max_workers=threads) as pool, disk_qcow.open(
+            "rb"
+        ) as src:
+            headers = disk_dir.tobuf(tarfile.PAX_FORMAT) + disk_file.tobuf(
+                tarfile.PAX_FORMAT
+            )
+            pending.append((None, headers, pool.submit(_gzip_member, headers)))
+
+            for index, (offset, length) in enumerate(chunks):
+                data = src.read(length)
+                if len(data) != length:
+                    raise OSError(f"Unexpected end of disk image at {offset}")
+                file_hash.update(data)
+
+                entry: Dict[str, Any] = (
+                    file_entry if index == 0 else dict(name=disk_file.name)
+                )
+                entry.update(
+                    type="reg" if index == 0 else "chunk",
+                    chunkOffset=offset,
+                    chunkSize=length,
+                    chunkDigest=f"sha256:{hashlib.sha256(data).hexdigest()}",
+                )
+                toc.append(entry)
+
+                if index == len(chunks) - 1:
+                    data += bytes(-disk_file.size % tarfile.BLOCKSIZE)
+                pending.append((entry, data, pool.submit(_gzip_member, data)))
+                drain(2 * threads)
+
+            drain(0)
+
+        if not chunks:
+            toc.append(file_entry)
+        file_entry["digest"] = f"sha256:{file_hash.hexdigest()}"
+
+        toc_json = json.dumps(dict(version=1, entries=toc)).encode()
+        toc_file = tarfile.TarInfo(ESTARGZ_TOC_NAME)
+        toc_file.size = len(toc_json)
+        toc_file.mode = 0o644
+        toc_data = (
+            toc_file.tobuf(tarfile.PAX_FORMAT)
+            + toc_json
+            + bytes(-len(toc_json) % tarfile.BLOCKSIZE)
+            + bytes(2 * tarfile.BLOCKSIZE)
+        )
+        diff.update(toc_data)
+        diff_size += len(toc_data)
+        toc_offset = writer.size
+        writer.write(_gzip_member(toc_data))
+        writer.write(_estargz_footer(toc_offset))
+
+    layer.replace(blobs / writer.digest.split(":", 1)[1])
+    descriptor = dict(
+        mediaType=OCI_LAYER_MEDIA_TYPE + "+gzip",
+        digest=writer.digest,
+        size=writer.size,
+        annotations={
+            ESTARGZ_TOC_DIGEST: f"sha256:{hashlib.sha256(toc_json).hexdigest()}",
+            ESTARGZ_UNCOMPRESSED_SIZE: str(diff_size),
+        },
+    )
+    return descriptor, f"sha256:{diff.hexdigest()}", file_entry["digest"]
+
+
+def _file_digest(path: Path) -> str:
+    file_hash = hashlib.sha256()
+    with path.open("rb") as file:
+        for data in iter(lambda: file.read(COPY_BUFSIZE), b""):
+            file_hash.update(data)
+    return f"sha256:{file_hash.hexdigest()}"
+
+
+def _layer_cache_key(args: argparse.Namespace, disk_qcow: Path) -> Dict[str, Any]:
+    """The layers only depend on the disk image and the layer options. The
+    disk image is identified by its path, size, modification time and inode,
+    so that rebuilding the image from an unchanged disk image does not have
+    to read it."""
+    stat = disk_qcow.stat()
+    return dict(
+        path=str(disk_qcow.resolve()),
+        size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+        inode=stat.st_ino,
+        layer_format=args.layer_format,
+        layer_compression=args.layer_compression,
+        source_date_epoch=_source_date_epoch(),
+    )
+
+
+def _layer_cache_path(key: Dict[str, Any]) -> Path:
+    key_digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode())
+    return xdg_cache_home() / "olive2022" / "layers" / f"{key_digest.hexdigest()}.json"
+
+
+def _cached_layers(layer_cache: Path, key: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Return the layer descriptors cached for a disk image and layer options."""
+    try:
+        cached: Dict[str, Any] = json.loads(layer_cache.read_text())
+    except (OSError, ValueError):
+        return None
+    return cached if cached.get("key") == key else None
+
+
+def _layer_blobs_available(
+    args: argparse.Namespace,
+    layers: List[Dict[str, Any]],
+    oci_layout: Path,
+    docker_tags: Sequence[str],
+) -> bool:
+    """Check that layer blobs are in the OCI image layout, or otherwise in
+    every registry the image will be pushed to."""
+    blobs = oci_layout / "blobs" / "sha256"
+    missing = [
+        layer["digest"]
+        for layer in layers
+        if not (blobs / layer["digest"].split(":", 1)[1]).exists()
+    ]
+    if missing and not docker_tags:
+        return False
+    for docker_tag in docker_tags if missing else []:
+        client, _ = _registry_client(args, docker_tag)
+        if not all(client.blob_exists(digest) for digest in missing):
+            return False
+    return True
+
+
+def _oci_write_image(
+    oci_layout: Path,
+    vmi_fullname: str,
+    layers: List[Dict[str, Any]],
+    diff_ids: List[str],
+) -> str:
+    """Write the image config, manifest and index of an OCI image layout,
+    returns the manifest digest."""
+    image_config = dict(
+        created=strftime("%Y-%m-%dT%H:%M:%SZ", gmtime(_source_date_epoch())),
+        architecture="amd64",
+        os="linux",
+        config=dict(
+            Labels={
+                "org.opencontainers.image.url": "https://olivearchive.org",
+                "org.opencontainers.image.title": vmi_fullname,
+            },
+        ),
+        rootfs=dict(type="layers", diff_ids=diff_ids),
+    )
+    config = _oci_write_blob(
+        oci_layout, OCI_CONFIG_MEDIA_TYPE, json.dumps(image_config).encode()
+    )
+
+    image_manifest = dict(
+        schemaVersion=2,
+        mediaType=OCI_MANIFEST_MEDIA_TYPE,
+        config=config,
+        layers=layers,
+    )
+    manifest = _oci_write_blob(
+        oci_layout, OCI_MANIFEST_MEDIA_TYPE, json.dumps(image_manifest).encode()
+    )
+    manifest["annotations"] = {"org.opencontainers.image.ref.name": "latest"}
+
+    (oci_layout / "index.json").write_text(
+        json.dumps(dict(schemaVersion=2, manifests=[manifest]))
+    )
+    return str(manifest["digest"])
+
+
+def _create_oci_layout(
+    args: argparse.Namespace,
+    tmpdir: Path,
+    disk_qcow: Path,
+    vmi_fullname: str,
+    report: Dict[str, Any],
+    docker_tags: Sequence[str] = (),
+) -> Path:
+    """Create a containerDisk image as an OCI image layout without docker.
+    The layer digests and the digest of the disk image are cached by the
+    path, size, modification time and inode of the disk image. When the
+    image that would be built is already in every registry it is pushed to,
+    the layers are not written at all, otherwise cached layers are reused as
+    long as the blobs are still available locally or in the registries.
+    """
+    oci_layout = tmpdir / "oci"
+    (oci_layout / "blobs" / "sha256").mkdir(parents=True, exist_ok=True)
+    (oci_layout / "oci-layout").write_text(json.dumps({"imageLayoutVersion": "1.0.0"}))
+
+    start = perf_counter()
+    cache_key = _layer_cache_key(args, disk_qcow)
+    layer_cache = _layer_cache_path(cache_key)
+    cached = _cached_layers(layer_cache, cache_key)
+
+    published = False
+    if cached is not None and docker_tags:
+        digest = _oci_write_image(
+            oci_layout, vmi_fullname, cached["layers"], cached["diff_ids"]
+        )
+        published = True
+        for docker_tag in docker_tags:
+            client, tag = _registry_client(args, docker_tag)
+            if client.manifest_digest(tag) != digest:
+                published = False
+                break
+    if (
+        cached is not None
+        and not published
+        and not _layer_blobs_available(args, cached["layers"], oci_layout, docker_tags)
+    ):
+        cached = None
+
+    if cached is not None:
+        print(
+            "Image is already published, not building image layers"
+            if published
+            else "Reusing cached image layers"
+        )
+        layers, diff_ids = cached["layers"], cached["diff_ids"]
+        disk_digest = cached["sha256"]
+        if cached["layer_compression"] is not None:
+            report["layer_compression"] = cached["layer_compression"]
+    elif args.layer_format == "estargz":
+        layer, diff_id, disk_digest = _oci_write_estargz_layer(
+            oci_layout, disk_qcow, args.threads
+        )
+        layers, diff_ids = (layer,), (diff_id,)
+    else:
+        compression = _layer_compression(args, disk_qcow, report)
+        layer, diff_id, disk_digest = _oci_write_layer(
+            oci_layout, disk_qcow, compression
+        )
+        layers, diff_ids = (layer,), (diff_id,)
+
+    if cached is None:
+        layer_cache.parent.mkdir(parents=True, exist_ok=True)
+        layer_cache.write_text(
+            json.dumps(
+                dict(
+                    key=cache_key,
+                    sha256=disk_digest,
+                    layers=list(layers),
+                    diff_ids=list(diff_ids),
+                    layer_compression=report.get("layer_compression"),
+                )
+            )
+        )
+
+    report["layers"] = dict(
+        format=args.layer_format,
+        disk_digest=disk_digest,
+        count=len(layers),
+        sizes=[layer["size"] for layer in layers],
+        seconds=perf_counter() - start,
+        cached=cached is not None,
+    )
+
+    _oci_write_image(oci_layout, vmi_fullname, list(layers), list(diff_ids))
+    return oci_layout
+
+
+class _RegistryClient:
+    """Minimal OCI distribution API client for pushing images."""
+
+    def __init__(self, registry: str, repository: str, credentials: Optional[str]):
+        self.base_url = URL(f"https://{registry}")
+        self.repository = repository
+        self.basic_auth = (
+            "Basic " + base64.b64encode(credentials.encode()).decode()
+            if credentials is not None
+            else None
+        )
+        self.authorization: Optional[str] = None
+
+    def _authenticate(self, challenge: str) -> None:
+        """Obtain an authorization for a WWW-Authenticate challenge."""
+        scheme, _, params = challenge.partition(" ")
+        if scheme.lower() == "basic":
+            self.authorization = self.basic_auth
+            return
+
+        attrs = dict(re.findall(r'(\w+)="([^"]*)"', params))
+        token_url = URL(attrs["realm"]).update_query(
+            service=attrs.get("service", self.base_url.host or ""),
+            scope=attrs.get("scope", f"repository:{self.repository}:pull,push"),
+        )
+        headers = {"Authorization": self.basic_auth} if self.basic_auth else {}
+        with _http_request(token_url, headers=headers) as response:
+            token = json.load(response)
+        self.authorization = "Bearer " + token.get("token", token.get("access_token"))
+
+    def request(
+        self,
+        method: str,
+        url: URL,
+        headers: Optional[Dict[str, str]] = None,
+        data: Optional[bytes] = None,
+    ) -> HTTPResponse:
+        """Send an authenticated request, url is relative to /v2/<name>/."""
+        url = self.base_url.join(URL(f"/v2/{self.repository}/")).join(url)
+        for _ in range(2):
+            request_headers = dict(headers or {})
+            if self.authorization is not None:
+                request_headers["Authorization"] = self.authorization
+            request = Request(str(url), data=data, headers=request_headers)
+            request.method = method
+            try:
+                response: HTTPResponse = urlopen(request)
+                return response
+            except HTTPError as exc:
+                challenge = exc.headers.get("www-authenticate")
+                if exc.code != 401 or challenge is None:
+                    raise
+                self._authenticate(challenge)
+        raise OSError(f"Failed to authenticate with {self.base_url}")
+
+    def blob_exists(self, digest: str) -> bool:
+        try:
+            with self.request("HEAD", URL(f"blobs/{digest}")):
+                return True
+        except HTTPError as exc:
+            if exc.code == 404:
+                return False
+            raise
+
+    def mount_blob(self, digest: str, repository: str) -> bool:
+        """Try to mount a blob from another repository on the same registry."""
+        url = URL("blobs/uploads/").with_query({"mount": digest, "from": repository})
+        try:
+            with self.request("POST", url) as response:
+                if response.status == 201:
+                    return True
+                location = URL(response.headers["location"])
+        except HTTPError:
+            return False
+
+        # the registry started a regular upload instead, cancel it
+        try:
+            with self.request("DELETE", location):
+                pass
+        except HTTPError:
+            pass
+        return False
+
+    def _start_upload(self) -> URL:
+        with self.request("POST", URL("blobs/uploads/")) as response:
+            return URL(response.headers["location"])
+
+    def _upload_offset(self, location: URL) -> Tuple[URL, int]:
+        """Ask the registry how much of an interrupted upload was received,
+        starts a new upload when the old one is no longer known."""
+        try:
+            with self.request("GET", location) as response:
+                received = response.headers.get("range", "0--1").split("-")[1]
+                return (
+                    URL(response.headers.get("location", location)),
+                    int(received) + 1,
+                )
+        except HTTPError as exc:
+            if exc.code != 404:
+                raise
+            return self._start_upload(), 0
+
+    def upload_blob(self, blob: Path, digest: str, progress: "tqdm[NoReturn]") -> None:
+        """Upload a blob in chunks, resuming after failed requests."""
+        size = blob.stat().st_size
+        location = self._start_upload()
+        offset = retries = 0
+
+        with blob.open("rb") as src:
+            while offset < size:
+                src.seek(offset)
+                chunk = src.read(REGISTRY_CHUNK_SIZE)
+                headers = {
+                    "Content-Type": "application/octet-stream",
+                    "Content-Range": f"{offset}-{offset + len(chunk) - 1}",
+                }
+                try:
+                    with self.request("PATCH", location, headers, chunk) as response:
+                        location = URL(response.headers["location"])
+                    offset += len(chunk)
+                    progress.update(len(chunk))
+                except (OSError, HTTPException) as exc:
+                    retries += 1
+                    if retries > REGISTRY_RETRIES:
+                        raise
+                    print(f"Upload of {digest} failed ({exc}), resuming")
+                    sleep(2**retries)
+                    location, received = self._upload_offset(location)
+                    progress.update(received - offset)
+                    offset = received
+
+        with self.request("PUT", location.update_query(digest=digest)):
+            pass
+
+    def manifest_digest(self, reference: str) -> Optional[str]:
+        """Return the digest of a manifest in the registry, if it exists."""
+        headers = {"Accept": OCI_MANIFEST_MEDIA_TYPE}
+        try:
+            with self.request(
+                "HEAD", URL(f"manifests/{reference}"), headers
+            ) as response:
+                digest: Optional[str] = response.headers.get("docker-content-digest")
+                return digest
+        except HTTPError as exc:
+            if exc.code == 404:
+                return None
+            raise
+
+    def put_manifest(self, reference: str, manifest: bytes, media_type: str) -> None:
+        headers = {"Content-Type": media_type}
+        with self.request("PUT", URL(f"manifests/{reference}"), headers, manifest):
+            pass
+
+
+def _docker_credentials(registry: str) -> Optional[str]:
+    """Credentials stored by 'docker login', either in the docker config or
+    by the credential helper configured for the registry."""
+    try:
+        docker_config = json.loads(
+            (Path.home() / ".docker" / "config.json").read_text()
+        )
+    except (OSError, ValueError):
+        return None
+
+    helper = docker_config.get("credHelpers", {}).get(
+        registry, docker_config.get("credsStore")
+    )
+    if helper is None:
+        try:
+            return base64.b64decode(docker_config["auths"][registry]["auth"]).decode()
+        except (KeyError, ValueError):
+            return None
+
+    try:
+        output = subprocess.run(
+            [f"docker-credential-{helper}", "get"],
+            input=registry,
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).stdout
+        credentials = json.loads(output)
+        return f"{credentials['Username']}:{credentials['Secret']}"
+    except (OSError, subprocess.CalledProcessError, KeyError, ValueError):
+        return None
+
+
+def _mirrors(args: argparse.Namespace) -> Dict[str, Optional[str]]:
+    """Mirrors are given as REGISTRY or REGISTRY=USER:TOKEN."""
+    mirrors: Dict[str, Optional[str]] = {}
+    for mirror in args.mirror:
+        registry, _, credentials = mirror.partition("=")
+        mirrors[registry] = credentials or None
+    return mirrors
+
+
+def _registry_token(args: argparse.Namespace, registry: str) -> Optional[str]:
+    """Credentials given for a registry, the deploy token is only used for
+    --registry and a mirror only gets the credentials given with it."""
+    host = registry.split("/", 1)[0]
+    if args.deploy_token is not None and host == args.registry.split("/", 1)[0]:
+        return str(args.deploy_token)
+    for mirror, credentials in _mirrors(args).items():
+        if credentials is not None and host == mirror.split("/", 1)[0]:
+            return credentials
+    return None
+
+
+def _registry_credentials(args: argparse.Namespace, registry: str) -> Optional[str]:
+    """Use the given credentials or fall back to those from 'docker login'."""
+    credentials = _registry_token(args, registry)
+    if credentials is not None:
+        return credentials
+    return _docker_credentials(registry)
+
+
+def _registry_client(
+    args: argparse.Namespace, docker_tag: str
+) -> Tuple[_RegistryClient, str]:
+    """Return a registry client for the repository of an image and its tag."""
+    name, tag = docker_tag.rsplit(":", 1)
+    registry, repository = name.split("/", 1)
+    client = _RegistryClient(
+        registry, repository, _registry_credentials(args, registry)
+    )
+    return client, tag
+
+
+def _push_oci_layout(
+    args: argparse.Namespace,
+    oci_layout: Path,
+    docker_tag: str,
+    mount_from: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Push an OCI image layout, blobs that already exist are skipped, mounted
+    from the mount_from repository on the same registry, or uploaded in
+    parallel before the manifest. Returns the manifest digest and statistics.
+    """
+    start = perf_counter()
+    client, tag = _registry_client(args, docker_tag)
+
+    blobs = oci_layout / "blobs" / "sha256"
+    index = json.loads((oci_layout / "index.json").read_text())
+    manifest = index["manifests"][0]
+    stats: Dict[str, Any] = dict(digest=manifest["digest"], existing=0, mounted=0)
+
+    if client.manifest_digest(tag) == manifest["digest"]:
+        print(f"Image is already published to {docker_tag}")
+        return dict(stats, published=True, uploaded=0, seconds=perf_counter() - start)
+
+    manifest_data = (blobs / manifest["digest"].split(":", 1)[1]).read_bytes()
+    image_manifest = json.loads(manifest_data)
+
+    missing = []
+    for descriptor in [image_manifest["config"]] + image_manifest["layers"]:
+        if client.blob_exists(descriptor["digest"]):
+            stats["existing"] += 1
+        elif mount_from is not None and client.mount_blob(
+            descriptor["digest"], mount_from
+        ):
+            stats["mounted"] += 1
+        else:
+            missing.append(descriptor)
+
+    with tqdm(
+        desc=docker_tag.split("/", 1)[0],
+        total=sum(descriptor["size"] for descriptor in missing),
+        unit="B",
+        unit_scale=True,
+        unit_divisor=1024,
+    ) as progress, ThreadPoolExecutor(max_workers=REGISTRY_UPLOADS) as pool:
+        for future in [
+            pool.submit(
+                client.upload_blob,
+                blobs / descriptor["digest"].split(":", 1)[1],
+                descriptor["digest"],
+                progress,
+            )
+            for descriptor in missing
+        ]:
+            future.result()
+
+    client.put_manifest(tag, manifest_data, manifest["mediaType"])
+    return dict(
+        stats,
+        published=False,
+        uploaded=sum(descriptor["size"] for descriptor in missing),
+        seconds=perf_counter() - start,
+    )
+
+
+def _publish_oci_layout(
+    args: argparse.Namespace, oci_layout: Path, docker_tags: List[str]
+) -> Dict[str, Dict[str, Any]]:
+    """Push an OCI image layout to several registries concurrently.
+    Images for the same registry are pushed one after the other, so that
+    blobs are uploaded once and mounted in the other repositories.
+    """
+    registries: Dict[str, List[str]] = {}
+    for docker_tag in docker_tags:
+        registries.setdefault(docker_tag.split("/", 1)[0], []).append(docker_tag)
+
+    def push(docker_tags: List[str]) -> Dict[str, Dict[str, Any]]:
+        first, *others = docker_tags
+        results = {first: _push_oci_layout(args, oci_layout, first)}
+        mount_from = first.rsplit(":", 1)[0].split("/", 1)[1]
+        for docker_tag in others:
+            results[docker_tag] = _push_oci_layout(
+                args, oci_layout, docker_tag, mount_from
+            )
+        return results
+
+    results: Dict[str, Dict[str, Any]] = {}
+    with ThreadPoolExecutor(max_workers=len(registries)) as pool:
+        for result in pool.map(push, registries.values()):
+            results.update(result)
+    return results
+
+
+def _docker_push(docker_tag: str, target: str) -> Dict[str, Any]:
+    """Push a docker image to a target and return its digest and timing."""
+    start = perf_counter()
+    if target != docker_tag:
+        subprocess.run(["docker", "tag", docker_tag, target], check=True)
+    subprocess.run(["docker", "push", target], check=True)
+    repo_digests = subprocess.run(
+        ["docker", "image", "inspect", "--format", "{{json .RepoDigests}}", target],
+        check=True,
+        stdout=subprocess.PIPE,
+        text=True,
+    ).stdout
     subprocess.run(
-        ["docker", "image", "rm", docker_tag], check=True, stdout=subprocess.DEVNULL
+        ["docker", "image", "rm", target], check=True, stdout=subprocess.DEVNULL
     )
 
+    repository = target.rsplit(":", 1)[0]
+    digest = None
+    for repo_digest in json.loads(repo_digests) or []:
+        name, _, repo_digest = str(repo_digest).partition("@")
+        if name == repository:
+            digest = repo_digest
+    return dict(digest=digest, seconds=perf_counter() - start)
+
+
+def _publish_containerdisk(
+    args: argparse.Namespace,
+    docker_tags: List[str],
+    report: Dict[str, Any],
+    oci_layout: Optional[Path] = None,
+) -> Optional[str]:
+    """Push the containerDisk image to the registry and any mirrors, returns
+    the digest of the image manifest."""
+    # upload container
+    print("Publishing containerDisk image")
+    if oci_layout is not None:
+        results = _publish_oci_layout(args, oci_layout, docker_tags)
+    else:
+        # the image was built with the first tag, which is removed last
+        docker_tag = docker_tags[0]
+        with ThreadPoolExecutor(max_workers=len(docker_tags)) as pool:
+            results = dict(
+                zip(
+                    docker_tags[1:],
+                    pool.map(
+                        lambda target: _docker_push(docker_tag, target),
+                        docker_tags[1:],
+                    ),
+                )
+            )
+        results[docker_tag] = _docker_push(docker_tag, docker_tag)
+
+    report["publish"] = results
+    for docker_tag, result in results.items():
+        print(f"Published {docker_tag} in {result['seconds']:.1f}s")
+    digest: Optional[str] = results[docker_tags[0]]["digest"]
+    return digest
+
+
+def _publish_registries(args: argparse.Namespace) -> List[str]:
+    """The registry and mirrors the containerDisk image is pushed to."""
+    registries = [args.registry] + list(_mirrors(args))
+    if args.prefer_mirror is not None:
+        registries.append(args.prefer_mirror)
+    return list(dict.fromkeys(registries))
+
 
 def _create_recipe(
     args: argparse.Namespace,
@@ -213,15 +2274,22 @@ def _create_recipe(
     sinfonia_uuid: uuid.UUID,
     cpus: int,
     memory: int,
+    image_digest: Optional[str] = None,
 ) -> None:
     recipes = Path("RECIPES")
 
+    container_disk: Dict[str, Any] = dict(
+        repository=args.prefer_mirror or args.registry,
+        name=str(sinfonia_uuid),
+        bus="sata",
+    )
+    # pinning the digest lets nodes use a cached image without asking the
+    # registry whether :latest changed
+    if image_digest is not None:
+        container_disk["digest"] = image_digest
+
     VALUES = dict(
-        containerDisk=dict(
-            repository=args.registry,
-            name=sinfonia_uuid,
-            bus="sata",
-        ),
+        containerDisk=container_disk,
         resources=dict(
             requests=dict(
                 cpu=cpus,
@@ -234,9 +2302,10 @@ def _create_recipe(
         restricted=False,
     )
 
-    if args.deploy_token is not None:
-        registry, _ = args.registry.split("/", 1)
-        username, password = args.deploy_token.split(":", 1)
+    pull_credentials = _registry_token(args, container_disk["repository"])
+    if pull_credentials is not None:
+        registry, _ = container_disk["repository"].split("/", 1)
+        username, password = pull_credentials.split(":", 1)
         VALUES.update(
             containerDiskCredentials=dict(
                 registry=registry,
@@ -253,80 +2322,927 @@ def _create_recipe(
             dict(
                 description=vmi_fullname,
                 chart="https://cmusatyalab.github.io/olive2022/vmi",
-                version="0.1.4",
+                version="0.1.5",
                 values=VALUES,
             )
         )
     )
 
 
-def convert(args: argparse.Namespace) -> int:
-    """Retrieve VMNetX image and convert to containerDisk + Sinfonia recipe."""
-    if args.dry_run:
-        print("Dry run not implemented for convert")
-        return 1
-
-    with TemporaryDirectory(dir="/var/tmp") as temporary_directory:
-        if args.tmp_dir:
-            temporary_directory = args.tmp_dir
-        tmpdir = Path(temporary_directory)
-        tmpdir.mkdir(exist_ok=True)
+def _resource_usage() -> Dict[str, Dict[str, float]]:
+    """CPU time, peak memory and block I/O of this process and of the child
+    processes (qemu-img, docker) that have completed."""
+    usage = {}
+    for scope, who in [
+        ("self", resource.RUSAGE_SELF),
+        ("children", resource.RUSAGE_CHILDREN),
+    ]:
+        rusage = resource.getrusage(who)
+        usage[scope] = dict(
+            cpu_user=rusage.ru_utime,
+            cpu_system=rusage.ru_stime,
+            max_rss=rusage.ru_maxrss * 1024,
+            block_in=rusage.ru_inblock,
+            block_out=rusage.ru_oublock,
+        )
+    return usage
+
+
+def _resource_usage_since(start: Dict[str, Dict[str, float]]) -> Dict[str, Any]:
+    """Resource usage since start, max_rss is the peak so far."""
+    usage = _resource_usage()
+    for scope, counters in usage.items():
+        for counter in counters:
+            if counter != "max_rss":
+                counters[counter] = round(counters[counter] - start[scope][counter], 3)
+    return usage
+
+
+class _MetricsFile:
+    """OpenMetrics textfile with the stage spans of conversions, for the
+    node_exporter textfile collector."""
+
+    METRICS = [
+        ("olive2022_stage_seconds", "Wall time of a conversion stage.", "seconds"),
+        ("olive2022_stage_input_bytes", "Bytes read by the stage.", "bytes_in"),
+        ("olive2022_stage_output_bytes", "Size of the stage output.", "bytes_out"),
+    ]
+    RESOURCE_METRICS = [
+        ("olive2022_stage_cpu_user_seconds", "User CPU time.", "cpu_user"),
+        ("olive2022_stage_cpu_system_seconds", "System CPU time.", "cpu_system"),
+        ("olive2022_stage_max_rss_bytes", "Peak resident set size.", "max_rss"),
+        ("olive2022_stage_block_input_operations", "Block reads.", "block_in"),
+        ("olive2022_stage_block_output_operations", "Block writes.", "block_out"),
+    ]
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.conversions: Dict[str, Dict[str, Any]] = {}
+        self.lock = Lock()
+
+    def update(self, sinfonia_uuid: uuid.UUID, stages: Dict[str, Any]) -> None:
+        """Replace the spans of a conversion and atomically rewrite the file."""
+        with self.lock:
+            self.conversions[str(sinfonia_uuid)] = stages
+
+            lines = []
+            for metric, help_, key in self.METRICS + self.RESOURCE_METRICS:
+                lines.append(f"# HELP {metric} {help_}")
+                lines.append(f"# TYPE {metric} gauge")
+                for conversion, spans in sorted(self.conversions.items()):
+                    for stage, span in spans.items():
+                        labels = f'uuid="{conversion}",stage="{stage}"'
+                        if key in span:
+                            lines.append(f"{metric}{{{labels}}} {span[key]}")
+                            continue
+                        for scope, usage in span["rusage"].items():
+                            lines.append(
+                                f'{metric}{{{labels},scope="{scope}"}} {usage[key]}'
+                            )
+            lines.append("# EOF")
+
+            tmpfile = self.path.with_name(self.path.name + ".tmp")
+            tmpfile.write_text("\n".join(lines) + "\n")
+            tmpfile.replace(self.path)
+
+
+def _write_report(sinfonia_uuid: uuid.UUID, report: Dict[str, Any]) -> None:
+    """Write the conversion report next to the Sinfonia recipe."""
+    recipes = Path("RECIPES")
+    recipes.mkdir(exist_ok=True)
+    (recipes / f"{sinfonia_uuid}.report.json").write_text(
+        json.dumps(report, indent=2) + "\n"
+    )
 
-        sinfonia_uuid = vmnetx_url_to_uuid(args.url)
-        print("UUID:", sinfonia_uuid)
 
-        # fetch vmnetx package
-        vmnetx_package = (
-            _fetch_vmnetx(args.url, tmpdir)
-            if args.vmnetx_package is None
-            else Path(args.vmnetx_package)
+class _StageCheckpoint:
+    """Completed conversion stages, with the size and sha256 digest of the
+    files they produced, kept in a state file in the work directory."""
+
+    def __init__(self, path: Path, options: Dict[str, Any]) -> None:
+        self.path = path
+        self.state: Dict[str, Any] = dict(options=options, stages=[])
+
+    @staticmethod
+    def _blob_digest(path: Path) -> Optional[str]:
+        """Blobs in an OCI image layout are named by their digest, which the
+        registry verifies when they are pushed, so they are not hashed."""
+        if path.parent.parts[-2:] == ("blobs", "sha256") and re.fullmatch(
+            "[0-9a-f]{64}", path.name
+        ):
+            return f"sha256:{path.name}"
+        return None
+
+    def _invalid(self, record: Dict[str, Any]) -> List[Path]:
+        """Outputs of a stage that are missing or were modified."""
+        invalid = []
+        for output in record["outputs"]:
+            path = Path(output["path"])
+            try:
+                if path.stat().st_size != output["size"]:
+                    invalid.append(path)
+                elif self._blob_digest(path) == output["sha256"]:
+                    continue
+                elif _file_digest(path) != output["sha256"]:
+                    invalid.append(path)
+            except OSError:
+                invalid.append(path)
+        return invalid
+
+    def resume(self) -> Optional[Dict[str, Any]]:
+        """Return the most recent completed stage whose outputs are still
+        valid, later stages are dropped from the checkpoint. Modified files
+        in the work directory are removed so that they are not reused."""
+        try:
+            saved = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return None
+        if saved.get("options") != self.state["options"]:
+            return None
+
+        workdir = self.path.parent.resolve()
+        stages: List[Dict[str, Any]] = saved.get("stages", [])
+        while stages:
+            invalid = self._invalid(stages[-1])
+            if not invalid:
+                break
+            for path in invalid:
+                if workdir in path.parents and path.exists():
+                    path.unlink()
+            stages.pop()
+        self.state["stages"] = stages
+        return stages[-1] if stages else None
+
+    def add(
+        self,
+        stage: str,
+        outputs: List[Path],
+        conversion: Dict[str, Any],
+        report: Dict[str, Any],
+    ) -> None:
+        """Record a completed stage and atomically update the state file."""
+        self.state["stages"].append(
+            dict(
+                stage=stage,
+                outputs=[
+                    dict(
+                        path=str(path.resolve()),
+                        size=path.stat().st_size,
+                        sha256=self._blob_digest(path) or _file_digest(path),
+                    )
+                    for path in outputs
+                ],
+                conversion=conversion,
+                report=report,
+            )
+        )
+        tmpfile = self.path.with_name(self.path.name + ".tmp")
+        tmpfile.write_text(json.dumps(self.state, indent=2))
+        tmpfile.replace(self.path)
+
+
+def _policy_file(path: str) -> Dict[str, Any]:
+    """Load a conversion policy, the answers to interactive prompts."""
+    try:
+        policy = yaml.safe_load(Path(path).read_text()) or {}
+    except (OSError, yaml.YAMLError) as exc:
+        raise argparse.ArgumentTypeError(f"unable to read policy: {exc}")
+
+    known = {"names", "allow_unrestricted_push", "fallback_name"}
+    if not isinstance(policy, dict) or not set(policy) <= known:
+        raise argparse.ArgumentTypeError(
+            f"policy should be a mapping with {', '.join(sorted(known))}"
+        )
+    if not isinstance(policy.get("names", {}), dict):
+        raise argparse.ArgumentTypeError("policy names should map urls to names")
+    try:
+        policy["names"] = {
+            _policy_name_key(str(key)): str(name)
+            for key, name in policy.get("names", {}).items()
+        }
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(f"invalid url in policy names: {exc}")
+    try:
+        str(policy.get("fallback_name", "")).format(uuid="", url="")
+    except (KeyError, IndexError, ValueError) as exc:
+        raise argparse.ArgumentTypeError(f"invalid policy fallback_name: {exc}")
+    return policy
+
+
+def _policy_name_key(key: str) -> str:
+    """Names are looked up by Sinfonia UUID, so that the https and
+    vmnetx+https spellings of a VMNetX URL both match."""
+    try:
+        return str(uuid.UUID(key))
+    except ValueError:
+        return str(vmnetx_url_to_uuid(URL(key)))
+
+
+class _UndecidedError(Exception):
+    """A conversion needs an answer that a headless conversion can't ask for."""
+
+    def __init__(self, decision: str, message: str) -> None:
+        super().__init__(message)
+        self.decision = decision
+
+
+class _Policy:
+    """Decides what would otherwise be asked interactively, the name of
+    packages without a VM image name and whether images that are not pushed
+    with a deploy token may be published."""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        policy = args.policy or {}
+        self.headless: bool = args.headless
+        self.names: Dict[str, str] = dict(policy.get("names", {}))
+        if getattr(args, "name", None) is not None:
+            self.names[str(vmnetx_url_to_uuid(args.url))] = args.name
+        self.fallback_name: Optional[str] = policy.get("fallback_name")
+        self.publish_allowed: bool = args.deploy_token is not None or bool(
+            policy.get("allow_unrestricted_push", False)
         )
 
-        # extract metadata and disk image
-        with ZipFile(vmnetx_package) as zipfile:
-            vmnetx_package_xml = zipfile.read("vmnetx-package.xml")
-            vmi_fullname = _parse_vmnetx_package_xml(vmnetx_package_xml)
-            print(vmi_fullname)
+    def vmi_name(self, url: URL, vmnetx_package_xml: bytes) -> str:
+        """Name override, the name from the package, or the fallback name."""
+        sinfonia_uuid = vmnetx_url_to_uuid(url)
+        name = self.names.get(str(sinfonia_uuid))
+        if name is not None:
+            return name
+
+        package_description = et.XML(vmnetx_package_xml)
+        if package_description.attrib["name"] not in VMNETX_UNNAMED:
+            return package_description.attrib["name"]
+        if self.fallback_name is not None:
+            return self.fallback_name.format(uuid=sinfonia_uuid, url=url)
+        if self.headless:
+            raise _UndecidedError("name", f"{url}: package has no VM image name")
+        return _parse_vmnetx_package_xml(vmnetx_package_xml)
+
+    def confirm_publish(self) -> None:
+        if self.headless:
+            raise _UndecidedError(
+                "publish",
+                "pushing a non-restricted image needs a deploy token "
+                "or allow_unrestricted_push in the policy",
+            )
+        if (
+            not input("Ok to push non-restricted image? [yes/no] ")
+            .lower()
+            .startswith("yes")
+        ):
+            sys.exit()
+
+    def check(
+        self, url: URL, vmnetx_package: Optional[str], publish_confirmed: bool
+    ) -> None:
+        """Fail before starting a headless conversion that would need to ask
+        for an answer, only the package metadata is fetched."""
+        if not self.headless:
+            return
+        if not publish_confirmed:
+            self.confirm_publish()
 
-            domain_xml = zipfile.read("domain.xml")
-            cpus, memory = _parse_domain_xml(domain_xml)
-            print("cpus", cpus, "memory", memory)
+        try:
+            if vmnetx_package is not None:
+                zipfile = ZipFile(vmnetx_package)
+            else:
+                zipfile = _open_remote_zipfile(url)
+            with zipfile:
+                vmnetx_package_xml = zipfile.read("vmnetx-package.xml")
+        except (OSError, BadZipFile, KeyError):
+            return  # the conversion itself will fail with a better error
+        self.vmi_name(url, vmnetx_package_xml)
+
+
+def _conversion_failed(
+    result: Dict[str, Any], url: URL, exc: Exception
+) -> Dict[str, Any]:
+    """Record why a conversion failed in its result."""
+    result["status"] = "failed"
+    if isinstance(exc, _UndecidedError):
+        result["error"] = str(exc)
+        result["decision"] = exc.decision
+    else:
+        result["error"] = f"{type(exc).__name__}: {exc}"
+    print(f"Failed to convert {url}: {result['error']}")
+    return result
+
+
+class _Conversion:
+    """Conversion of a VMNetX package to a containerDisk image and Sinfonia
+    recipe, split in stages so that conversions can be pipelined."""
+
+    STAGES = ["fetch", "extract", "recompress", "build", "publish", "recipe"]
+
+    def __init__(
+        self,
+        args: argparse.Namespace,
+        url: URL,
+        vmnetx_package: Optional[str],
+        tmpdir: Path,
+    ) -> None:
+        self.args = args
+        self.url = url
+        self.package = vmnetx_package
+        self.tmpdir = tmpdir
+        self.sinfonia_uuid = vmnetx_url_to_uuid(url)
+        self.report: Dict[str, Any] = dict(uuid=str(self.sinfonia_uuid), url=str(url))
+        self.policy = _Policy(args)
+        self.publish_confirmed = self.policy.publish_allowed or args.benchmark_codecs
+
+        self.vmnetx_package: Optional[Path] = None
+        self.metadata: Dict[str, bytes] = {}
+        self.vmi_fullname = ""
+        self.cpus = self.memory = 0
+        self.disk_img: Optional[Path] = None
+        self.disk_source = ""
+        self.disk_size = 0
+        self.disk_from_package = False
+        self.disk_qcow: Optional[Path] = None
+        self.oci_layout: Optional[Path] = None
+        self.docker_tags: List[str] = []
+        self.image_digest: Optional[str] = None
+        # bytes transferred by the fetch stage, other stages read their input
+        self.fetch_stats: Dict[str, Any] = {}
+
+        # intermediate files in a tmp-dir are kept, so completed stages are
+        # recorded to be able to resume an interrupted conversion
+        self.checkpoint: Optional[_StageCheckpoint] = None
+        self.completed: List[str] = []
+        self.metrics: Optional[_MetricsFile] = None
+        self.package_pins: Optional[_PackagePins] = None
+        if args.tmp_dir is not None:
+            self.checkpoint = _StageCheckpoint(
+                tmpdir / CONVERSION_STATE, self._options()
+            )
 
-            # extract disk image
-            print("Extracting disk image")
-            zipfile.extract("disk.img", path=tmpdir)
-            disk_img = tmpdir / "disk.img"
+    def _options(self) -> Dict[str, Any]:
+        """Options that affect the result of the conversion."""
+        ignored = {
+            "func",
+            "dry_run",
+            "headless",
+            "policy",
+            "tmp_dir",
+            "staging_dir",
+            "deploy_token",
+            "connections",
+            "cache_size",
+            "qemu_img_coroutines",
+            "threads",
+            "jobs",
+            "fetch_workers",
+            "recompress_workers",
+            "publish_workers",
+            "disk_budget",
+            "metrics_file",
+            "summary",
+            "manifest",
+        }
+        options = {
+            key: value for key, value in vars(self.args).items() if key not in ignored
+        }
+        options.update(
+            mirror=list(_mirrors(self.args)), url=self.url, vmnetx_package=self.package
+        )
+        return dict(json.loads(json.dumps(options, default=str)))
+
+    def _outputs(self, stage: str) -> Optional[List[Path]]:
+        """Files produced by a stage that are used by the next stage, None
+        when the stage can not be checkpointed."""
+        if stage == "fetch":
+            outputs = [self.vmnetx_package or self.disk_img]
+        elif stage == "extract":
+            outputs = [self.disk_img or self.vmnetx_package]
+        elif stage == "recompress":
+            outputs = [self.disk_qcow]
+        elif stage == "build" and self.disk_qcow is not None:
+            # images built with docker are stored by the docker daemon, the
+            # build is redone but that is cheap with the docker build cache
+            if self.oci_layout is None:
+                return None
+            return sorted(path for path in self.oci_layout.rglob("*") if path.is_file())
+        else:
+            outputs = []
+        return [path for path in outputs if path is not None]
+
+    def _save_state(self) -> Dict[str, Any]:
+        def path(value: Optional[Path]) -> Optional[str]:
+            return str(value.resolve()) if value is not None else None
+
+        return dict(
+            vmnetx_package=path(self.vmnetx_package),
+            metadata={
+                name: base64.b64encode(data).decode()
+                for name, data in self.metadata.items()
+            },
+            vmi_fullname=self.vmi_fullname,
+            cpus=self.cpus,
+            memory=self.memory,
+            disk_img=path(self.disk_img),
+            disk_source=self.disk_source,
+            disk_size=self.disk_size,
+            disk_from_package=self.disk_from_package,
+            disk_qcow=path(self.disk_qcow),
+            oci_layout=path(self.oci_layout),
+            docker_tags=self.docker_tags,
+            image_digest=self.image_digest,
+        )
 
-        if args.tmp_dir is None and args.vmnetx_package is None:
-            vmnetx_package.unlink()
+    def _load_state(self, state: Dict[str, Any]) -> None:
+        def path(value: Optional[str]) -> Optional[Path]:
+            return Path(value) if value is not None else None
+
+        self.vmnetx_package = path(state["vmnetx_package"])
+        self.metadata = {
+            name: base64.b64decode(data) for name, data in state["metadata"].items()
+        }
+        self.vmi_fullname = state["vmi_fullname"]
+        self.cpus, self.memory = state["cpus"], state["memory"]
+        self.disk_img = path(state["disk_img"])
+        self.disk_source = state["disk_source"]
+        self.disk_size = state["disk_size"]
+        self.disk_from_package = state["disk_from_package"]
+        self.disk_qcow = path(state["disk_qcow"])
+        self.oci_layout = path(state["oci_layout"])
+        self.docker_tags = state["docker_tags"]
+        self.image_digest = state["image_digest"]
+
+    def resume(self) -> None:
+        """Continue after the last completed stage with valid outputs."""
+        if self.checkpoint is None:
+            return
+        record = self.checkpoint.resume()
+        if record is None:
+            return
+
+        self._load_state(record["conversion"])
+        self.report = record["report"]
+        self.completed = self.STAGES[: self.STAGES.index(record["stage"]) + 1]
+        self.report["resumed"] = self.completed
+        print("Resuming conversion after", record["stage"], "stage")
+
+    def run_stage(self, stage: str) -> None:
+        """Run a stage and record a span with its wall time, the size of the
+        files it read and produced and its resource usage. Resource usage is
+        process wide, so it includes stages of concurrent conversions."""
+        if stage in self.completed:
+            return
+
+        usage = _resource_usage()
+        start = perf_counter()
+        getattr(self, stage)()
+        seconds = perf_counter() - start
+
+        outputs = self._outputs(stage)
+        bytes_out = sum(path.stat().st_size for path in outputs or [] if path.exists())
+        stages = self.report.setdefault("stages", {})
+        index = self.STAGES.index(stage)
+        previous = stages.get(self.STAGES[index - 1]) if index else None
+        if stage == "fetch":
+            bytes_in = self.fetch_stats.get("bytes_read", 0)
+        else:
+            bytes_in = previous["bytes_out"] if previous is not None else bytes_out
+        stages[stage] = dict(
+            seconds=round(seconds, 3),
+            bytes_in=bytes_in,
+            bytes_out=bytes_out,
+            throughput=round(bytes_in / seconds) if bytes_in and seconds else None,
+            rusage=_resource_usage_since(usage),
+        )
+        _write_report(self.sinfonia_uuid, self.report)
+        if self.metrics is not None:
+            self.metrics.update(self.sinfonia_uuid, stages)
+
+        if self.checkpoint is None:
+            return
+        if outputs is None:
+            self.checkpoint = None
+            return
+        self.checkpoint.add(stage, outputs, self._save_state(), self.report)
+
+    def fetch(self) -> None:
+        args = self.args
+        if args.stream and self.package is None:
+            # extract disk image while the vmnetx package is being fetched
+            self.metadata, self.disk_img = _stream_vmnetx(
+                self.url, self.tmpdir, self.fetch_stats
+            )
+            self.disk_source = str(self.disk_img.resolve())
+            self.disk_size = self.disk_img.stat().st_size
+
+        # fetch vmnetx package, partial downloads are kept outside of the
+        # temporary directory so that they can be resumed
+        elif self.package is not None:
+            self.vmnetx_package = Path(self.package)
+        elif args.cache_size:
+            self.vmnetx_package = _fetch_cached_vmnetx(
+                self.url,
+                self.sinfonia_uuid,
+                args.connections,
+                args.cache_size * 1024**3,
+                self.package_pins,
+                self.fetch_stats,
+            )
+        else:
+            # staged with the other intermediate files, which the disk
+            # budget of convert-batch accounts for
+            download_dir = Path(args.tmp_dir or args.staging_dir)
+            self.vmnetx_package = _fetch_vmnetx(
+                self.url,
+                download_dir / f"{self.sinfonia_uuid}.zip",
+                args.connections,
+                stats=self.fetch_stats,
+            )
 
-        # convert disk image
-        print("Recompressing disk image")
-        disk_qcow = _recompress_disk(disk_img, tmpdir)
+    def extract(self) -> None:
+        """Extract metadata and disk image."""
+        if self.vmnetx_package is None:
+            self._parse_metadata()
+            return
+
+        with ZipFile(self.vmnetx_package) as zipfile:
+            for name in ["vmnetx-package.xml", "domain.xml"]:
+                self.metadata[name] = zipfile.read(name)
+            self._parse_metadata()
+
+            # a stored disk image is converted in place, only compressed
+            # disk images have to be extracted first
+            disk_info = zipfile.getinfo("disk.img")
+            disk_view = _zip_member_view(self.vmnetx_package, disk_info)
+            self.disk_size = disk_info.file_size
+
+            with zipfile.open(disk_info) as disk_member:
+                disk_member_is_raw = disk_member.read(4) != QCOW2_MAGIC
+
+            if disk_view is not None:
+                self.disk_source = disk_view
+            elif not _extracts_disk(self.args, disk_info, disk_member_is_raw):
+                # inflated straight into the qcow2 image when recompressing,
+                # no raw disk image is written to disk
+                self.disk_from_package = True
+            else:
+                print("Extracting disk image")
+                self.disk_img = _extract_sparse(
+                    zipfile, disk_info, self.tmpdir / "disk.img"
+                )
+                self.disk_source = str(self.disk_img.resolve())
+
+    def _parse_metadata(self) -> None:
+        self.vmi_fullname = self.policy.vmi_name(
+            self.url, self.metadata["vmnetx-package.xml"]
+        )
+        print(self.vmi_fullname)
+
+        self.cpus, self.memory = _parse_domain_xml(self.metadata["domain.xml"])
+        print("cpus", self.cpus, "memory", self.memory)
+
+    def recompress(self) -> None:
+        """Convert disk image."""
+        args = self.args
+        if args.benchmark_codecs:
+            print("Benchmarking qcow2 compression types")
+            _benchmark_codecs(
+                args, self.disk_source, self.disk_size, self.tmpdir, self.report
+            )
+        elif self.disk_from_package:
+            assert self.vmnetx_package is not None
+            print("Recompressing disk image from package")
+            with ZipFile(self.vmnetx_package) as zipfile, zipfile.open(
+                "disk.img"
+            ) as disk_member:
+                self.disk_qcow = _native_recompress(
+                    args, disk_member, self.disk_size, self.tmpdir, self.report
+                )
+        else:
+            print("Recompressing disk image")
+            self.disk_qcow = _recompress_disk(
+                args, self.disk_source, self.disk_size, self.tmpdir, self.report
+            )
 
         if args.tmp_dir is None:
-            disk_img.unlink()
+            if self.disk_img is not None:
+                self.disk_img.unlink()
+            if (
+                self.vmnetx_package is not None
+                and self.package is None
+                and not args.cache_size
+            ):
+                self.vmnetx_package.unlink()
+
+    def build(self) -> None:
+        """Create containerDisk image."""
+        args, disk_qcow = self.args, self.disk_qcow
+        if disk_qcow is None:  # only benchmarked
+            return
 
-        # create containerdisk image
         print("Creating containerDisk image")
-        docker_tag = _create_containerdisk(
-            args, disk_qcow.parent, vmi_fullname, sinfonia_uuid
+        self.docker_tags = [
+            f"{registry}/{self.sinfonia_uuid}:latest"
+            for registry in _publish_registries(args)
+        ]
+        if args.builder == "oci":
+            self.oci_layout = _create_oci_layout(
+                args,
+                self.tmpdir,
+                disk_qcow,
+                self.vmi_fullname,
+                self.report,
+                self.docker_tags,
+            )
+
+            # the layout is reproducible, so its digest is also valid when
+            # the layout is pushed later
+            index = json.loads((self.oci_layout / "index.json").read_text())
+            self.image_digest = index["manifests"][0]["digest"]
+
+            if args.tmp_dir is None:
+                disk_qcow.unlink()
+        else:
+            self.docker_tags[0] = _create_containerdisk(
+                args, disk_qcow.parent, self.vmi_fullname, self.sinfonia_uuid
+            )
+
+            if args.tmp_dir is None:
+                disk_qcow.unlink()
+        self.report["image_digest"] = self.image_digest
+
+    def publish(self) -> None:
+        """Push containerDisk image, intermediate files are removed unless a
+        tmp-dir is used."""
+        if self.disk_qcow is None:
+            return
+        if not self.publish_confirmed:
+            self.policy.confirm_publish()
+
+        self.image_digest = _publish_containerdisk(
+            self.args, self.docker_tags, self.report, self.oci_layout
         )
+        self.report["image_digest"] = self.image_digest
+
+        if self.args.tmp_dir is None:
+            if self.oci_layout is not None:
+                rmtree(self.oci_layout)
+            self.tmpdir.rmdir()
+
+    def recipe(self) -> None:
+        """Create Sinfonia recipe."""
+        if self.disk_qcow is not None:
+            print("Creating Sinfonia recipe", self.sinfonia_uuid)
+            _create_recipe(
+                self.args,
+                self.vmi_fullname,
+                self.sinfonia_uuid,
+                self.cpus,
+                self.memory,
+                self.image_digest,
+            )
 
-        if args.tmp_dir is None:
-            disk_qcow.unlink()
-            tmpdir.rmdir()
 
-            _publish_containerdisk(args, docker_tag)
+def _estimate_footprint(
+    args: argparse.Namespace, url: URL, vmnetx_package: Optional[str]
+) -> Optional[int]:
+    """Estimate the peak disk usage of a conversion in the staging directory
+    from the zip central directory, the downloaded package, the extracted raw
+    disk image and the qcow2 image, which is copied once more into the OCI
+    image layer. Local packages and packages in the package cache, which is
+    bounded by its own size limit, are not staged. The raw disk image is only
+    counted when the extract stage would write it."""
+    try:
+        if vmnetx_package is not None:
+            zipfile = ZipFile(vmnetx_package)
+        else:
+            zipfile = _open_remote_zipfile(url)
+        with zipfile:
+            package_size = sum(info.compress_size for info in zipfile.infolist())
+            disk_info = zipfile.getinfo("disk.img")
+            extracted = args.stream
+            if not extracted and disk_info.compress_type != ZIP_STORED:
+                with zipfile.open(disk_info) as disk_member:
+                    disk_member_is_raw = disk_member.read(4) != QCOW2_MAGIC
+                extracted = _extracts_disk(args, disk_info, disk_member_is_raw)
+    except (OSError, BadZipFile, KeyError):
+        return None
+
+    downloaded = vmnetx_package is None and not args.stream and not args.cache_size
+    if not downloaded:
+        package_size = 0
+
+    deflated = disk_info.compress_type == ZIP_DEFLATED
+    raw_size = disk_info.file_size if extracted else 0
+
+    # qcow2 compression is comparable to the deflate compression of the package
+    qcow2_size = disk_info.compress_size if deflated else disk_info.file_size
+    if args.builder == "oci":
+        qcow2_size *= 2
+    return package_size + raw_size + qcow2_size
+
+
+class _DiskBudget:
+    """Admit conversions while their estimated disk usage fits in a budget,
+    a conversion that is larger than the budget runs on its own."""
+
+    def __init__(self, budget: int) -> None:
+        self.budget = budget
+        self.used = 0
+        self.condition = Condition()
+
+    def acquire(self, size: int, name: str) -> int:
+        size = min(size, self.budget)
+        with self.condition:
+            if self.used + size > self.budget:
+                print(f"Waiting for {size // 1024**2} MiB of disk space for {name}")
+            self.condition.wait_for(lambda: self.used + size <= self.budget)
+            self.used += size
+        return size
+
+    def release(self, size: int) -> None:
+        with self.condition:
+            self.used -= size
+            self.condition.notify_all()
+
+
+def convert(args: argparse.Namespace) -> int:
+    """Retrieve VMNetX image and convert to containerDisk + Sinfonia recipe."""
+    if args.dry_run:
+        print("Dry run not implemented for convert")
+        return 1
+
+    # only a warning, so a remote package is not range read for it
+    footprint = (
+        _estimate_footprint(args, args.url, args.vmnetx_package)
+        if args.vmnetx_package is not None
+        else None
+    )
+    available = disk_usage(args.staging_dir).free
+    if footprint is not None and footprint > available:
+        print(
+            f"Conversion may need {footprint // 1024**2} MiB of disk space, "
+            f"{args.staging_dir} has {available // 1024**2} MiB available"
+        )
 
-    # create Sinfonia recipe
-    print("Creating Sinfonia recipe", sinfonia_uuid)
-    _create_recipe(args, vmi_fullname, sinfonia_uuid, cpus, memory)
+    with TemporaryDirectory(dir=args.staging_dir) as temporary_directory:
+        tmpdir = Path(args.tmp_dir or temporary_directory)
+        tmpdir.mkdir(exist_ok=True)
 
-    input("Done, hit return to quit\n")
+        conversion = _Conversion(args, args.url, args.vmnetx_package, tmpdir)
+        if args.metrics_file is not None:
+            conversion.metrics = _MetricsFile(args.metrics_file)
+        print("UUID:", conversion.sinfonia_uuid)
+        result: Dict[str, Any] = dict(
+            url=str(args.url), uuid=str(conversion.sinfonia_uuid)
+        )
+        try:
+            conversion.policy.check(
+                args.url, args.vmnetx_package, conversion.publish_confirmed
+            )
+            conversion.resume()
+
+            for stage in _Conversion.STAGES:
+                conversion.run_stage(stage)
+        except Exception as exc:
+            if not args.headless:
+                raise
+            # report a machine readable result instead of a traceback
+            print(json.dumps(_conversion_failed(result, args.url, exc)))
+            return 1
+
+    if args.headless:
+        result.update(status="converted", image_digest=conversion.image_digest)
+        print(json.dumps(result))
+    elif conversion.disk_qcow is not None:
+        input("Done, hit return to quit\n")
     return 0
 
 
+def _read_batch_manifest(manifest: Path) -> List[Tuple[URL, Optional[str]]]:
+    """Parse a list of 'VMNETX_URL [VMNETX_PACKAGE]' lines."""
+    jobs: List[Tuple[URL, Optional[str]]] = []
+    for line in manifest.read_text().splitlines():
+        fields = line.split("#", 1)[0].split()
+        if fields:
+            jobs.append((URL(fields[0]), fields[1] if len(fields) > 1 else None))
+    return jobs
+
+
+def convert_batch(args: argparse.Namespace) -> int:
+    """Convert a list of VMNetX images, pipelining the conversion stages."""
+    if args.dry_run:
+        print("Dry run not implemented for convert-batch")
+        return 1
+
+    jobs = _read_batch_manifest(args.manifest)
+    policy = _Policy(args)
+    metrics = _MetricsFile(args.metrics_file) if args.metrics_file else None
+    publish_confirmed = policy.publish_allowed or args.benchmark_codecs
+    if not publish_confirmed and not args.headless:
+        if (
+            not input("Ok to push non-restricted images? [yes/no] ")
+            .lower()
+            .startswith("yes")
+        ):
+            return 1
+        publish_confirmed = True
+
+    # each stage has its own bounded worker pool, so that fetching and
+    # publishing overlap with recompressing other images
+    workers = dict(
+        fetch=args.fetch_workers,
+        extract=args.recompress_workers,
+        recompress=args.recompress_workers,
+        build=args.recompress_workers,
+        publish=args.publish_workers,
+        recipe=1,
+    )
+    pools = {
+        stage: ThreadPoolExecutor(max_workers=workers[stage], thread_name_prefix=stage)
+        for stage in _Conversion.STAGES
+    }
+
+    # admit conversions while their estimated peak disk usage fits the budget
+    budget = _DiskBudget(
+        int(args.disk_budget * 1024**3) or disk_usage(args.staging_dir).free
+    )
+
+    # cached packages of running conversions are not evicted when other
+    # conversions add packages to the cache
+    package_pins = _PackagePins()
+
+    def convert_job(
+        url: URL, vmnetx_package: Optional[str], result: Dict[str, Any]
+    ) -> None:
+        with TemporaryDirectory(dir=args.staging_dir) as temporary_directory:
+            tmpdir = Path(temporary_directory)
+            if args.tmp_dir is not None:
+                tmpdir = Path(args.tmp_dir) / str(vmnetx_url_to_uuid(url))
+                tmpdir.mkdir(parents=True, exist_ok=True)
+
+            conversion = _Conversion(args, url, vmnetx_package, tmpdir)
+            conversion.publish_confirmed = publish_confirmed
+            conversion.metrics = metrics
+            conversion.package_pins = package_pins
+            cached_package = _cached_vmnetx_path(conversion.sinfonia_uuid)
+            package_pins.pin(cached_package)
+            try:
+                conversion.resume()
+                for stage in _Conversion.STAGES:
+                    pools[stage].submit(conversion.run_stage, stage).result()
+                result["status"] = "converted"
+            except Exception as exc:  # keep going with the other images
+                _conversion_failed(result, url, exc)
+            finally:
+                package_pins.unpin(cached_package)
+
+        result["image_digest"] = conversion.image_digest
+        result["stages"] = conversion.report.get("stages", {})
+
+    def run(job: Tuple[URL, Optional[str]]) -> Dict[str, Any]:
+        url, vmnetx_package = job
+        result: Dict[str, Any] = dict(
+            url=str(url),
+            package=vmnetx_package,
+            uuid=str(vmnetx_url_to_uuid(url)),
+            disk_estimate=None,
+            image_digest=None,
+            stages={},
+        )
+        try:
+            policy.check(url, vmnetx_package, publish_confirmed)
+        except _UndecidedError as exc:
+            return _conversion_failed(result, url, exc)
+
+        footprint = _estimate_footprint(args, url, vmnetx_package)
+        result["disk_estimate"] = footprint
+        reserved = budget.acquire(
+            footprint if footprint is not None else budget.budget, str(url)
+        )
+        try:
+            convert_job(url, vmnetx_package, result)
+        finally:
+            budget.release(reserved)
+        return result
+
+    start = perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.jobs) as driver:
+            results = list(driver.map(run, jobs))
+    finally:
+        for pool in pools.values():
+            pool.shutdown()
+
+    failed = sum(result["status"] == "failed" for result in results)
+    summary = dict(
+        seconds=perf_counter() - start,
+        converted=len(results) - failed,
+        failed=failed,
+        jobs=results,
+    )
+    args.summary.parent.mkdir(parents=True, exist_ok=True)
+    args.summary.write_text(json.dumps(summary, indent=2))
+    print(f"Converted {len(results) - failed} of {len(results)} images")
+    return 1 if failed else 0
+
+
 def install(args: argparse.Namespace) -> int:
     """Create and install desktop file to handle VMNetX URLs."""
     uninstall(args)
@@ -394,10 +3310,14 @@ def uninstall(args: argparse.Namespace) -> int:
 def add_subcommand(
     subp: "argparse._SubParsersAction[argparse.ArgumentParser]",
     func: Callable[[argparse.Namespace], int],
+    parents: Optional[List[argparse.ArgumentParser]] = None,
 ) -> argparse.ArgumentParser:
     """Helper to add a subcommand to argparse."""
     subparser = subp.add_parser(
-        func.__name__, help=func.__doc__, description=func.__doc__
+        func.__name__.replace("_", "-"),
+        help=func.__doc__,
+        description=func.__doc__,
+        parents=parents or [],
     )
     subparser.set_defaults(func=func)
     return subparser
@@ -448,12 +3368,28 @@ def main() -> int:
     # uninstall
     add_subcommand(subparsers, uninstall)
 
+    # inspect
+    inspect_parser = add_subcommand(subparsers, inspect)
+    inspect_parser.add_argument(
+        "--json", action="store_true", help="output metadata as json"
+    )
+    inspect_parser.add_argument("url", metavar="VMNETX_URL", type=URL)
+    inspect_parser.add_argument("vmnetx_package", nargs="?")
+
     # convert
-    convert_parser = add_subcommand(subparsers, convert)
-    convert_parser.add_argument(
-        "--tmp-dir", help="directory to keep intermediate files"
+    convert_options = argparse.ArgumentParser(add_help=False)
+    convert_options.add_argument(
+        "--tmp-dir",
+        help="directory to keep intermediate files, an interrupted conversion "
+        "resumes after the last completed stage",
     )
-    convert_parser.add_argument(
+    convert_options.add_argument(
+        "--staging-dir",
+        default=os.environ.get("OLIVE2022_STAGING_DIR", "/var/tmp"),
+        help="directory for temporary files [OLIVE2022_STAGING_DIR] "
+        "(default: /var/tmp)",
+    )
+    convert_options.add_argument(
         "--registry",
         default=os.environ.get(
             "OLIVE2022_REGISTRY",
@@ -461,14 +3397,184 @@ def main() -> int:
         ),
         help="registry where to store containerDisk [OLIVE2022_REGISTRY]",
     )
-    convert_parser.add_argument(
+    convert_options.add_argument(
+        "--mirror",
+        action="append",
+        default=os.environ.get("OLIVE2022_MIRRORS", "").split(),
+        help="additional registry where to store containerDisk, as REGISTRY or "
+        "REGISTRY=USER:TOKEN, without credentials the ones from 'docker login' "
+        "are used, can be repeated [OLIVE2022_MIRRORS]",
+    )
+    convert_options.add_argument(
+        "--prefer-mirror",
+        metavar="MIRROR",
+        help="registry to pull the containerDisk from in the recipe "
+        "(default: --registry)",
+    )
+    convert_options.add_argument(
         "--deploy-token",
         default=os.environ.get("OLIVE2022_CREDENTIALS"),
         help="docker pull credentials to add to recipe [OLIVE2022_CREDENTIALS]",
     )
+    convert_options.add_argument(
+        "--connections",
+        type=int,
+        default=DOWNLOAD_CONNECTIONS,
+        help="number of concurrent connections used to fetch the package",
+    )
+    convert_options.add_argument(
+        "--cache-size",
+        type=int,
+        default=int(
+            os.environ.get("OLIVE2022_CACHE_SIZE", PACKAGE_CACHE_SIZE // 1024**3)
+        ),
+        help="size of the local package cache in GiB, 0 disables caching "
+        "[OLIVE2022_CACHE_SIZE]",
+    )
+    convert_options.add_argument(
+        "--qemu-img-coroutines",
+        type=_qemu_img_coroutines,
+        default="auto",
+        help="number of parallel qemu-img coroutines, 'auto' uses the number "
+        f"of cpus up to {QEMU_IMG_MAX_COROUTINES} (default: auto)",
+    )
+    convert_options.add_argument(
+        "--qcow2-options",
+        help="qcow2 creation options passed to qemu-img (e.g. cluster_size=2M)",
+    )
+    convert_options.add_argument(
+        "--qcow2-writer",
+        choices=QCOW2_WRITERS,
+        default="qemu-img",
+        help="create qcow2 image with qemu-img or the built-in writer, which "
+        "falls back to qemu-img for images it does not support (default: qemu-img)",
+    )
+    convert_options.add_argument(
+        "--threads",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of compression threads for the built-in qcow2 writer",
+    )
+    convert_options.add_argument(
+        "--compression-type",
+        choices=QCOW2_COMPRESSION_TYPES,
+        default="zlib",
+        help="qcow2 compression type (default: zlib)",
+    )
+    convert_options.add_argument(
+        "--benchmark-codecs",
+        action="store_true",
+        help="compare qcow2 compression types on a sample of the disk image "
+        "instead of creating a containerDisk",
+    )
+    convert_options.add_argument(
+        "--benchmark-sample",
+        type=int,
+        default=BENCHMARK_SAMPLE_SIZE,
+        help=f"size of the benchmark sample in MiB (default: {BENCHMARK_SAMPLE_SIZE})",
+    )
+    convert_options.add_argument(
+        "--builder",
+        choices=CONTAINERDISK_BUILDERS,
+        default="oci",
+        help="write the containerDisk as an OCI image layout and push it to the "
+        "registry, or build and push it with docker (default: oci)",
+    )
+    convert_options.add_argument(
+        "--layer-compression",
+        type=_layer_compression_option,
+        choices=LAYER_COMPRESSIONS,
+        default="auto",
+        help="compression of the containerDisk image layer, 'auto' measures a "
+        "sample of the qcow2 image and only compresses when it pays off, zstd "
+        "needs the zstandard package (default: auto)",
+    )
+    convert_options.add_argument(
+        "--layer-format",
+        choices=LAYER_FORMATS,
+        default="tar",
+        help="write the containerDisk image layer as a plain tar or as a gzip "
+        "compressed eStargz layer that can be pulled lazily (default: tar)",
+    )
+    convert_options.add_argument(
+        "--stream",
+        action="store_true",
+        help="extract the disk image while the package is fetched, "
+        "bypasses the package cache",
+    )
+    convert_options.add_argument(
+        "--metrics-file",
+        type=Path,
+        default=os.environ.get("OLIVE2022_METRICS_FILE"),
+        help="also write stage timings and resource usage as an OpenMetrics "
+        "textfile for the node_exporter textfile collector [OLIVE2022_METRICS_FILE]",
+    )
+    convert_options.add_argument(
+        "--headless",
+        action="store_true",
+        help="never prompt, conversions that need an answer that is not in "
+        "the policy fail with a json error",
+    )
+    convert_options.add_argument(
+        "--policy",
+        type=_policy_file,
+        default=os.environ.get("OLIVE2022_POLICY"),
+        help="yaml file with names, fallback_name and allow_unrestricted_push "
+        "answers for prompts [OLIVE2022_POLICY]",
+    )
+    convert_parser = add_subcommand(subparsers, convert, [convert_options])
+    convert_parser.add_argument(
+        "--name", help="VM image name, overrides the name in the package"
+    )
     convert_parser.add_argument("url", metavar="VMNETX_URL", type=URL)
     convert_parser.add_argument("vmnetx_package", nargs="?")
 
+    # convert-batch
+    batch_parser = add_subcommand(subparsers, convert_batch, [convert_options])
+    batch_parser.add_argument(
+        "--jobs",
+        type=int,
+        default=4,
+        help="number of images that are converted at the same time (default: 4)",
+    )
+    batch_parser.add_argument(
+        "--fetch-workers",
+        type=int,
+        default=2,
+        help="number of packages that are fetched at the same time (default: 2)",
+    )
+    batch_parser.add_argument(
+        "--recompress-workers",
+        type=int,
+        default=1,
+        help="number of images that are extracted, recompressed or built at "
+        "the same time (default: 1)",
+    )
+    batch_parser.add_argument(
+        "--publish-workers",
+        type=int,
+        default=2,
+        help="number of images that are published at the same time (default: 2)",
+    )
+    batch_parser.add_argument(
+        "--disk-budget",
+        type=float,
+        default=0,
+        help="disk space in GiB that conversions may use in the staging "
+        "directory, 0 uses the space available when starting (default: 0)",
+    )
+    batch_parser.add_argument(
+        "--summary",
+        type=Path,
+        default=Path("RECIPES", "summary.json"),
+        help="where to write the conversion summary (default: RECIPES/summary.json)",
+    )
+    batch_parser.add_argument(
+        "manifest",
+        type=Path,
+        help="file with a 'VMNETX_URL [VMNETX_PACKAGE]' line for each image",
+    )
+
     # stage2
     add_subcommand(subparsers, stage2)
 
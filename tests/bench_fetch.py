@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+"""Measure package fetch throughput against the number of connections.
+
+The stand-in server adds per-request latency and limits the rate of each
+connection, which is what makes a single stream slow on long paths.
+
+    python tests/bench_fetch.py --size 64 --rate 8 --latency 0.05
+"""
+
+import argparse
+import os
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any
+
+from rangeserver import RangeServer
+from yarl import URL
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+import olive2022  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=64, help="package MiB")
+    parser.add_argument("--rate", type=float, default=8, help="MiB/s per connection")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds")
+    parser.add_argument("--segment", type=int, default=4, help="segment MiB")
+    parser.add_argument("--connections", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    http_request = olive2022._http_request
+
+    def _http_request(url: URL, *args: Any, **kwargs: Any) -> Any:
+        return http_request(url.with_scheme("http"), *args, **kwargs)
+
+    olive2022._http_request = _http_request  # type: ignore[assignment]
+    olive2022.DOWNLOAD_SEGMENT_SIZE = args.segment * 1024**2
+
+    data = os.urandom(args.size * 1024**2)
+    server = RangeServer(data, latency=args.latency, rate=int(args.rate * 1024**2))
+    with server, TemporaryDirectory() as tmpdir:
+        print("connections  seconds  MiB/s")
+        for connections in args.connections:
+            package = Path(tmpdir, f"{connections}.zip")
+            start = perf_counter()
+            olive2022._fetch_vmnetx(URL(server.url()), package, connections)
+            elapsed = perf_counter() - start
+            assert package.read_bytes() == data
+            package.unlink()
+            print(f"{connections:11d}  {elapsed:7.2f}  {args.size / elapsed:5.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+import os
+from typing import Any, Iterator
+from urllib.request import Request, urlopen
+
+import pytest
+from rangeserver import RangeServer
+from yarl import URL
+
+import olive2022
+
+
+@pytest.fixture
+def plain_http(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Packages are always fetched and images pushed over https, talk plain
+    http to the stand-in servers instead."""
+    http_request = olive2022._http_request
+
+    def _http_request(url: URL, *args: Any, **kwargs: Any) -> Any:
+        return http_request(url.with_scheme("http"), *args, **kwargs)
+
+    def _urlopen(request: Request) -> Any:
+        request.full_url = str(URL(request.full_url).with_scheme("http"))
+        return urlopen(request)
+
+    monkeypatch.setattr(olive2022, "_http_request", _http_request)
+    monkeypatch.setattr(olive2022, "urlopen", _urlopen)
+
+
+@pytest.fixture
+def package_data() -> bytes:
+    return os.urandom(5 * 1024 * 1024 + 12345)
+
+
+@pytest.fixture
+def range_server(package_data: bytes, plain_http: None) -> Iterator[RangeServer]:
+    with RangeServer(package_data) as server:
+        yield server
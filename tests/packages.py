@@ -0,0 +1,56 @@
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+"""Synthetic vmnetx packages."""
+
+import random
+from pathlib import Path
+from zipfile import ZIP_DEFLATED, ZipFile
+
+MiB = 1024 * 1024
+
+DOMAIN_XML = """\
+<domain type='kvm'>
+  <name>test</name>
+  <memory>1048576</memory>
+  <vcpu>2</vcpu>
+</domain>
+"""
+
+
+def disk_image(size: int, seed: int = 0) -> bytes:
+    """Disk image with random, compressible and all-zero MiB blocks."""
+    rng = random.Random(seed)
+    text = b"hello world " * (MiB // 12 + 1)
+    blocks = []
+    for index in range(-(-size // MiB)):
+        kind = index % 4
+        if kind == 0:
+            blocks.append(rng.getrandbits(8 * MiB).to_bytes(MiB, "little"))
+        elif kind == 1:
+            blocks.append(text[:MiB])
+        else:
+            blocks.append(bytes(MiB))
+    return b"".join(blocks)[:size]
+
+
+def make_package(
+    path: Path,
+    disk: bytes,
+    name: str = "Test VM",
+    compress_type: int = ZIP_DEFLATED,
+) -> Path:
+    """Write a vmnetx package with the given disk image."""
+    with ZipFile(path, "w", compression=compress_type) as package:
+        package.writestr(
+            "vmnetx-package.xml",
+            '<?xml version="1.0"?>'
+            '<image xmlns="http://olivearchive.org/xmlns/vmnetx/package"'
+            f' name="{name}"><domain path="domain.xml"/><disk path="disk.img"/>'
+            "</image>",
+        )
+        package.writestr("domain.xml", DOMAIN_XML)
+        package.writestr("disk.img", disk)
+    return path
@@ -0,0 +1,142 @@
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+"""In-process HTTP server that serves a file with Range, ETag and
+conditional request support, used as a stand-in for the Olive Archive."""
+
+import hashlib
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, List, Optional, Tuple
+
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeServer(ThreadingHTTPServer):
+    """Serves data at every path.
+
+    ranges: advertise and honour Range requests
+    ignore_ranges: advertise Range support but answer with the whole file
+    latency: seconds to wait before answering a request
+    rate: bytes per second per connection, 0 is unlimited
+    fail_after: abort a response after sending this many bytes
+    fail_skip: number of responses to complete before aborting one
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        data: bytes,
+        ranges: bool = True,
+        latency: float = 0.0,
+        rate: int = 0,
+    ) -> None:
+        super().__init__(("127.0.0.1", 0), _RangeHandler)
+        self.data = data
+        self.ranges = ranges
+        self.ignore_ranges = False
+        self.latency = latency
+        self.rate = rate
+        self.fail_after: Optional[int] = None
+        self.fail_skip = 0
+        self.requests: List[Tuple[str, Optional[str]]] = []
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def etag(self) -> str:
+        return '"' + hashlib.sha256(self.data).hexdigest()[:16] + '"'
+
+    def url(self, path: str = "package.vmnetx", scheme: str = "vmnetx+https") -> str:
+        host, port = self.server_address[:2]
+        return f"{scheme}://{host}:{port}/{path}"
+
+    def handle_error(self, request: Any, client_address: Any) -> None:
+        pass  # clients that hang up early are expected
+
+    def __enter__(self) -> "RangeServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    server: RangeServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+    def _headers(self, status: int, length: int, start: int = 0) -> None:
+        server = self.server
+        self.send_response(status)
+        self.send_header("Content-Length", str(length))
+        self.send_header("ETag", server.etag)
+        self.send_header("Last-Modified", "Sat, 01 Jan 2022 00:00:00 GMT")
+        if server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            end = start + length - 1
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(server.data)}")
+        self.end_headers()
+
+    def do_HEAD(self) -> None:
+        with self.server.lock:
+            self.server.requests.append(("HEAD", None))
+        self._headers(200, len(self.server.data))
+
+    def do_GET(self) -> None:
+        server = self.server
+        range_header = self.headers.get("Range")
+        with server.lock:
+            server.requests.append(("GET", range_header))
+        time.sleep(server.latency)
+
+        if self.headers.get("If-None-Match") == server.etag:
+            self._headers(304, 0)
+            return
+
+        start, end = 0, len(server.data)
+        if_range = self.headers.get("If-Range")
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", range_header or "")
+        if (
+            server.ranges
+            and not server.ignore_ranges
+            and match
+            and if_range in (None, server.etag)
+        ):
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end - 1) + 1, end)
+            self._headers(206, end - start, start)
+        else:
+            self._headers(200, end - start)
+
+        with server.lock:
+            fail_after = None
+            if server.fail_after is not None and server.fail_skip == 0:
+                fail_after, server.fail_after = server.fail_after, None
+            elif server.fail_after is not None:
+                server.fail_skip -= 1
+
+        offset = start
+        while offset < end:
+            chunk = server.data[offset : min(offset + CHUNK_SIZE, end)]
+            if fail_after is not None and offset - start + len(chunk) > fail_after:
+                self.wfile.write(chunk[: max(fail_after - (offset - start), 0)])
+                self.close_connection = True
+                return
+            self.wfile.write(chunk)
+            offset += len(chunk)
+            with server.lock:
+                server.bytes_sent += len(chunk)
+            if server.rate:
+                time.sleep(len(chunk) / server.rate)
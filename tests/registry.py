@@ -0,0 +1,266 @@
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+"""In-process stand-in for an OCI distribution registry with chunked
+uploads, cross repository mounts and basic or bearer token authentication."""
+
+import base64
+import hashlib
+import re
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+
+class Registry(ThreadingHTTPServer):
+    """Stores blobs and manifests in memory.
+
+    auth: None, "basic" or "bearer"
+    credentials: the user:password accepted for basic auth and token requests
+    fail_patch: abort the PATCH request after this many have completed, only
+        half of its chunk is stored and no response is sent
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self, auth: Optional[str] = None, credentials: str = "user:secret"
+    ) -> None:
+        super().__init__(("127.0.0.1", 0), _RegistryHandler)
+        self.auth = auth
+        self.credentials = credentials
+        self.fail_patch: Optional[int] = None
+        self.blobs: Dict[Tuple[str, str], bytes] = {}
+        self.manifests: Dict[Tuple[str, str], Tuple[str, bytes]] = {}
+        self.uploads: Dict[str, Tuple[str, bytearray]] = {}
+        self.tokens: Set[str] = set()
+        self.requests: List[Tuple[str, str]] = []
+        self.bytes_received = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def host(self) -> str:
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    def handle_error(self, request: Any, client_address: Any) -> None:
+        pass  # aborted uploads are expected
+
+    def __enter__(self) -> "Registry":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class _RegistryHandler(BaseHTTPRequestHandler):
+    server: Registry
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+    def _respond(
+        self, status: int, headers: Optional[Dict[str, str]] = None, body: bytes = b""
+    ) -> None:
+        self.send_response(status)
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _authorized(self, repository: str) -> bool:
+        server = self.server
+        basic = "Basic " + base64.b64encode(server.credentials.encode()).decode()
+        authorization = self.headers.get("Authorization")
+        if server.auth == "basic" and authorization != basic:
+            challenge = 'Basic realm="registry"'
+        elif server.auth == "bearer" and (
+            authorization is None
+            or authorization.partition(" ")[2] not in server.tokens
+        ):
+            challenge = (
+                f'Bearer realm="http://{server.host}/token",service="registry",'
+                f'scope="repository:{repository}:pull,push"'
+            )
+        else:
+            return True
+        self._body()
+        self._respond(401, {"WWW-Authenticate": challenge})
+        return False
+
+    def _token(self) -> None:
+        server = self.server
+        basic = "Basic " + base64.b64encode(server.credentials.encode()).decode()
+        if self.headers.get("Authorization") != basic:
+            self._respond(401)
+            return
+        token = uuid.uuid4().hex
+        with server.lock:
+            server.tokens.add(token)
+        self._respond(200, body=f'{{"token": "{token}"}}'.encode())
+
+    def _route(self) -> None:
+        server = self.server
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        with server.lock:
+            server.requests.append((self.command, self.path))
+
+        if url.path == "/token":
+            self._token()
+            return
+
+        match = re.fullmatch(r"/v2/(.+?)/(blobs|manifests)/(.*)", url.path)
+        if match is None:
+            self._respond(404)
+            return
+        repository, kind, reference = match.groups()
+        if not self._authorized(repository):
+            return
+
+        handler = getattr(self, f"_{self.command.lower()}_{kind}", None)
+        if handler is None:
+            self._body()
+            self._respond(405)
+            return
+        handler(repository, reference, query)
+
+    do_HEAD = do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = _route
+
+    def _head_blobs(self, repository: str, digest: str, query: Dict[str, str]) -> None:
+        blob = self.server.blobs.get((repository, digest))
+        if blob is None:
+            self._respond(404)
+        else:
+            self._respond(200, {"Docker-Content-Digest": digest})
+
+    def _head_manifests(
+        self, repository: str, reference: str, query: Dict[str, str]
+    ) -> None:
+        manifest = self.server.manifests.get((repository, reference))
+        if manifest is None:
+            self._respond(404)
+            return
+        media_type, data = manifest
+        digest = "sha256:" + hashlib.sha256(data).hexdigest()
+        self._respond(
+            200, {"Content-Type": media_type, "Docker-Content-Digest": digest}
+        )
+
+    def _upload(self, reference: str) -> Optional[Tuple[str, bytearray]]:
+        upload_id = reference.split("/")[-1]
+        upload = self.server.uploads.get(upload_id)
+        if upload is None:
+            self._body()
+            self._respond(404)
+        return upload
+
+    def _upload_headers(self, repository: str, upload_id: str) -> Dict[str, str]:
+        received = len(self.server.uploads[upload_id][1])
+        return {
+            "Location": f"/v2/{repository}/blobs/uploads/{upload_id}",
+            "Range": f"0-{received - 1}",
+        }
+
+    def _get_blobs(
+        self, repository: str, reference: str, query: Dict[str, str]
+    ) -> None:
+        if self._upload(reference) is not None:
+            upload_id = reference.split("/")[-1]
+            self._respond(204, self._upload_headers(repository, upload_id))
+
+    def _post_blobs(
+        self, repository: str, reference: str, query: Dict[str, str]
+    ) -> None:
+        server = self.server
+        self._body()
+        digest = query.get("mount")
+        if digest is not None:
+            blob = server.blobs.get((query["from"], digest))
+            if blob is not None:
+                with server.lock:
+                    server.blobs[(repository, digest)] = blob
+                self._respond(201, {"Docker-Content-Digest": digest})
+                return
+
+        upload_id = uuid.uuid4().hex
+        with server.lock:
+            server.uploads[upload_id] = (repository, bytearray())
+        self._respond(202, self._upload_headers(repository, upload_id))
+
+    def _patch_blobs(
+        self, repository: str, reference: str, query: Dict[str, str]
+    ) -> None:
+        server = self.server
+        upload = self._upload(reference)
+        if upload is None:
+            return
+        upload_id = reference.split("/")[-1]
+        data = self._body()
+        with server.lock:
+            server.bytes_received += len(data)
+        start = int(self.headers["Content-Range"].split("-")[0])
+        if start != len(upload[1]):
+            self._respond(416, self._upload_headers(repository, upload_id))
+            return
+
+        with server.lock:
+            fail = server.fail_patch == 0
+            if server.fail_patch is not None:
+                server.fail_patch -= 1
+        if fail:
+            upload[1].extend(data[: len(data) // 2])
+            self.close_connection = True
+            return
+
+        upload[1].extend(data)
+        self._respond(202, self._upload_headers(repository, upload_id))
+
+    def _put_blobs(
+        self, repository: str, reference: str, query: Dict[str, str]
+    ) -> None:
+        server = self.server
+        upload = self._upload(reference)
+        if upload is None:
+            return
+        data = upload[1] + self._body()
+        digest = query["digest"]
+        if digest != "sha256:" + hashlib.sha256(data).hexdigest():
+            self._respond(400)
+            return
+        with server.lock:
+            server.blobs[(repository, digest)] = bytes(data)
+            del server.uploads[reference.split("/")[-1]]
+        self._respond(201, {"Docker-Content-Digest": digest})
+
+    def _delete_blobs(
+        self, repository: str, reference: str, query: Dict[str, str]
+    ) -> None:
+        upload_id = reference.split("/")[-1]
+        with self.server.lock:
+            self.server.uploads.pop(upload_id, None)
+        self._respond(204)
+
+    def _put_manifests(
+        self, repository: str, reference: str, query: Dict[str, str]
+    ) -> None:
+        data = self._body()
+        media_type = self.headers["Content-Type"]
+        digest = "sha256:" + hashlib.sha256(data).hexdigest()
+        with self.server.lock:
+            self.server.manifests[(repository, reference)] = (media_type, data)
+            self.server.manifests[(repository, digest)] = (media_type, data)
+        self._respond(201, {"Docker-Content-Digest": digest})
@@ -0,0 +1,91 @@
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+import threading
+from argparse import Namespace
+from pathlib import Path
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+import pytest
+from packages import MiB, disk_image, make_package
+from yarl import URL
+
+import olive2022
+
+PACKAGE_URL = URL("vmnetx+https://olivearchive.example/test.vmnetx")
+
+
+def footprint_args(**options: object) -> Namespace:
+    args = dict(
+        stream=False,
+        cache_size=0,
+        builder="oci",
+        qcow2_writer="native",
+        compression_type="zlib",
+        qcow2_options=None,
+        benchmark_codecs=False,
+    )
+    args.update(options)
+    return Namespace(**args)
+
+
+@pytest.mark.parametrize(
+    "compress_type, disk_format, qcow2_writer, extracted",
+    [
+        (ZIP_STORED, "raw", "native", False),
+        (ZIP_DEFLATED, "raw", "native", False),
+        (ZIP_DEFLATED, "qcow2", "native", True),
+        (ZIP_DEFLATED, "raw", "qemu-img", True),
+    ],
+)
+def test_estimate_footprint(
+    tmp_path: Path,
+    compress_type: int,
+    disk_format: str,
+    qcow2_writer: str,
+    extracted: bool,
+) -> None:
+    disk = disk_image(4 * MiB)
+    if disk_format == "qcow2":
+        disk = olive2022.QCOW2_MAGIC + disk[4:]
+    package = make_package(tmp_path / "package.zip", disk, compress_type=compress_type)
+    with ZipFile(package) as zipfile:
+        disk_info = zipfile.getinfo("disk.img")
+
+    args = footprint_args(qcow2_writer=qcow2_writer)
+    footprint = olive2022._estimate_footprint(args, PACKAGE_URL, str(package))
+
+    # a local package is not staged, the qcow2 image is counted twice
+    qcow2_size = disk_info.compress_size if compress_type == ZIP_DEFLATED else len(disk)
+    raw_size = len(disk) if extracted else 0
+    assert footprint == raw_size + 2 * qcow2_size
+
+
+def test_budget_waits() -> None:
+    budget = olive2022._DiskBudget(100)
+    first = budget.acquire(60, "first")
+    admitted = threading.Event()
+
+    def second() -> None:
+        budget.release(budget.acquire(60, "second"))
+        admitted.set()
+
+    thread = threading.Thread(target=second)
+    thread.start()
+    # the second job does not fit next to the first one, it waits
+    assert not admitted.wait(0.2)
+    budget.release(first)
+    assert admitted.wait(5)
+    thread.join()
+    assert budget.used == 0
+
+
+def test_budget_larger_than_budget() -> None:
+    """A job that is larger than the whole budget runs on its own."""
+    budget = olive2022._DiskBudget(100)
+    reserved = budget.acquire(250, "large")
+    assert reserved == 100 and budget.used == 100
+    budget.release(reserved)
+    assert budget.used == 0
@@ -0,0 +1,142 @@
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+import hashlib
+import json
+import sys
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List
+
+import pytest
+from packages import MiB, disk_image, make_package
+from registry import Registry
+
+import olive2022
+
+
+def test_checkpoint_skips_hashing_blobs(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    blobs = tmp_path / "oci" / "blobs" / "sha256"
+    blobs.mkdir(parents=True)
+    data = b"layer data"
+    blob = blobs / hashlib.sha256(data).hexdigest()
+    blob.write_bytes(data)
+    index = tmp_path / "oci" / "index.json"
+    index.write_text("{}")
+
+    hashed: List[Path] = []
+    file_digest = olive2022._file_digest
+
+    def _file_digest(path: Path) -> str:
+        hashed.append(path)
+        return file_digest(path)
+
+    monkeypatch.setattr(olive2022, "_file_digest", _file_digest)
+
+    state = tmp_path / olive2022.CONVERSION_STATE
+    checkpoint = olive2022._StageCheckpoint(state, {})
+    checkpoint.add("build", [blob, index], {}, {})
+    record = olive2022._StageCheckpoint(state, {}).resume()
+    assert record is not None and record["stage"] == "build"
+    assert hashed == [index, index]
+
+    # a blob is only checked by its size
+    blob.write_bytes(b"short")
+    assert olive2022._StageCheckpoint(state, {}).resume() is None
+    assert not blob.exists()
+
+
+URL = "vmnetx+https://olivearchive.example/test.vmnetx"
+
+
+@pytest.fixture
+def convert(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, plain_http: None
+) -> Iterator[Callable[[str], Dict[str, Any]]]:
+    """Run a headless conversion with a kept --tmp-dir, returns its report."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    package = make_package(tmp_path / "package.zip", disk_image(4 * MiB))
+    uuid = olive2022.vmnetx_url_to_uuid(olive2022.URL(URL))
+
+    with Registry(auth="basic") as registry:
+
+        def run(deploy_token: str) -> Dict[str, Any]:
+            monkeypatch.setattr(
+                sys,
+                "argv",
+                [
+                    "olive2022",
+                    "convert",
+                    "--headless",
+                    "--qcow2-writer=native",
+                    f"--tmp-dir={tmp_path / 'tmp'}",
+                    f"--staging-dir={tmp_path}",
+                    f"--registry={registry.host}/olive",
+                    f"--deploy-token={deploy_token}",
+                    "--cache-size=0",
+                    URL,
+                    str(package),
+                ],
+            )
+            olive2022.main()
+            report: Dict[str, Any] = json.loads(
+                Path("RECIPES", f"{uuid}.report.json").read_text()
+            )
+            return report
+
+        yield run
+
+
+def test_resume_after_failed_publish(
+    convert: Callable[[str], Dict[str, Any]], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    report = convert("user:wrong")
+    assert "image_digest" in report and "publish" not in report["stages"]
+
+    def recompress(*args: Any) -> None:
+        raise AssertionError("recompressed again")
+
+    monkeypatch.setattr(olive2022, "_native_recompress", recompress)
+    resumed = convert("user:secret")
+    assert resumed["resumed"] == ["fetch", "extract", "recompress", "build"]
+    assert "publish" in resumed["stages"]
+    assert resumed["image_digest"] == report["image_digest"]
+
+
+def test_resume_rebuilds_modified_qcow2(
+    convert: Callable[[str], Dict[str, Any]],
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+) -> None:
+    def create_oci_layout(*args: Any) -> None:
+        raise OSError("build failed")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(olive2022, "_create_oci_layout", create_oci_layout)
+        report = convert("user:secret")
+    assert list(report["stages"]) == ["fetch", "extract", "recompress"]
+
+    disk_qcow = tmp_path / "tmp" / "disk.qcow2"
+    qcow2 = disk_qcow.read_bytes()
+    with disk_qcow.open("r+b") as image:
+        image.seek(len(qcow2) // 2)
+        image.write(bytes([qcow2[len(qcow2) // 2] ^ 0xFF]))
+
+    recompressed: List[Path] = []
+    native_recompress = olive2022._native_recompress
+
+    def recompress(*args: Any) -> Path:
+        recompressed.append(disk_qcow)
+        assert not disk_qcow.exists(), "modified qcow2 image was not removed"
+        return native_recompress(*args)
+
+    monkeypatch.setattr(olive2022, "_native_recompress", recompress)
+    resumed = convert("user:secret")
+    assert resumed["resumed"] == ["fetch", "extract"]
+    assert recompressed and disk_qcow.read_bytes() == qcow2
+    assert "publish" in resumed["stages"]
@@ -0,0 +1,98 @@
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+import gzip
+import hashlib
+import io
+import json
+import re
+import tarfile
+import zlib
+from pathlib import Path
+from typing import Any, Dict
+
+from packages import MiB, disk_image
+
+import olive2022
+
+FOOTER_SIZE = 51
+
+
+def gzip_member(layer: bytes, offset: int) -> bytes:
+    """Decompress the single gzip member that starts at offset."""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    data = decompressor.decompress(layer[offset:])
+    assert decompressor.eof
+    return data
+
+
+def read_toc(layer: bytes) -> bytes:
+    """Find the table of contents through the footer, as a lazy-pulling
+    snapshotter does with a range request for the end of the layer."""
+    footer = layer[-FOOTER_SIZE:]
+    assert gzip_member(footer, 0) == b""
+    match = re.fullmatch(rb".{12}SG\x16\x00([0-9a-f]{16})STARGZ.{13}", footer, re.S)
+    assert match is not None
+    toc_offset = int(match.group(1), 16)
+
+    with tarfile.open(fileobj=io.BytesIO(gzip_member(layer, toc_offset))) as toc_tar:
+        member = toc_tar.next()
+        assert member is not None and member.name == olive2022.ESTARGZ_TOC_NAME
+        toc_file = toc_tar.extractfile(member)
+        assert toc_file is not None
+        return toc_file.read()
+
+
+def test_estargz_layer(tmp_path: Path) -> None:
+    raw = disk_image(32 * MiB)
+    disk_qcow = tmp_path / "disk.qcow2"
+    olive2022._write_qcow2(io.BytesIO(raw), len(raw), disk_qcow, threads=2)
+    qcow2 = disk_qcow.read_bytes()
+
+    oci_layout = tmp_path / "oci"
+    (oci_layout / "blobs" / "sha256").mkdir(parents=True)
+    descriptor, diff_id, disk_digest = olive2022._oci_write_estargz_layer(
+        oci_layout, disk_qcow, threads=2
+    )
+    layer = (oci_layout / "blobs" / "sha256" / descriptor["digest"][7:]).read_bytes()
+    assert descriptor["digest"] == "sha256:" + hashlib.sha256(layer).hexdigest()
+
+    toc_json = read_toc(layer)
+    toc: Dict[str, Any] = json.loads(toc_json)
+    annotations = descriptor["annotations"]
+    toc_digest = "sha256:" + hashlib.sha256(toc_json).hexdigest()
+    assert annotations[olive2022.ESTARGZ_TOC_DIGEST] == toc_digest
+
+    # read the disk image chunk by chunk through the index
+    entries = [entry for entry in toc["entries"] if entry["name"] == "disk/disk.qcow2"]
+    assert entries[0]["type"] == "reg" and entries[0]["size"] == len(qcow2)
+    assert {entry["type"] for entry in entries[1:]} == {"chunk"}
+    disk = bytearray()
+    for entry in entries:
+        assert entry["chunkOffset"] == len(disk)
+        chunk = gzip_member(layer, entry["offset"])[: entry["chunkSize"]]
+        assert entry["chunkDigest"] == "sha256:" + hashlib.sha256(chunk).hexdigest()
+        disk += chunk
+    assert disk == qcow2
+    assert entries[0]["digest"] == "sha256:" + hashlib.sha256(qcow2).hexdigest()
+    assert disk_digest == entries[0]["digest"]
+
+    # the qcow2 header and L1/L2 tables are in small chunks
+    hot = olive2022.ESTARGZ_HOT_CHUNK_SIZE
+    assert entries[0]["chunkSize"] == hot
+    assert any(entry["chunkSize"] > hot for entry in entries)
+
+    # it is also a regular gzip compressed tar
+    diff = gzip.decompress(layer)
+    assert diff_id == "sha256:" + hashlib.sha256(diff).hexdigest()
+    assert annotations[olive2022.ESTARGZ_UNCOMPRESSED_SIZE] == str(len(diff))
+    with tarfile.open(fileobj=io.BytesIO(diff)) as tar:
+        assert tar.getnames() == [
+            "disk",
+            "disk/disk.qcow2",
+            olive2022.ESTARGZ_TOC_NAME,
+        ]
+        disk_file = tar.extractfile("disk/disk.qcow2")
+        assert disk_file is not None and disk_file.read() == qcow2
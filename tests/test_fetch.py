@@ -0,0 +1,134 @@
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+import json
+import os
+from http.client import HTTPException
+from pathlib import Path
+from typing import Any, Dict
+
+import pytest
+from rangeserver import RangeServer
+from yarl import URL
+
+import olive2022
+
+SEGMENT_SIZE = 1024 * 1024
+
+
+@pytest.fixture(autouse=True)
+def small_segments(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(olive2022, "DOWNLOAD_SEGMENT_SIZE", SEGMENT_SIZE)
+
+
+def ranged_gets(server: RangeServer) -> int:
+    return sum(method == "GET" and rng is not None for method, rng in server.requests)
+
+
+def test_segmented_fetch(
+    range_server: RangeServer, package_data: bytes, tmp_path: Path
+) -> None:
+    package = tmp_path / "package.zip"
+    olive2022._fetch_vmnetx(URL(range_server.url()), package, connections=4)
+
+    assert package.read_bytes() == package_data
+    assert ranged_gets(range_server) == -(-len(package_data) // SEGMENT_SIZE)
+    assert not list(tmp_path.glob("*.part")) and not list(tmp_path.glob("*.checkpoint"))
+
+
+def test_fetch_without_ranges(
+    range_server: RangeServer, package_data: bytes, tmp_path: Path
+) -> None:
+    range_server.ranges = False
+    package = tmp_path / "package.zip"
+    olive2022._fetch_vmnetx(URL(range_server.url()), package, connections=4)
+
+    assert package.read_bytes() == package_data
+    assert range_server.requests == [("HEAD", None), ("GET", None)]
+
+
+def test_fetch_resumes(
+    range_server: RangeServer, package_data: bytes, tmp_path: Path
+) -> None:
+    package = tmp_path / "package.zip"
+    range_server.fail_after = SEGMENT_SIZE // 2
+    range_server.fail_skip = 2
+    with pytest.raises((OSError, HTTPException)):
+        olive2022._fetch_vmnetx(URL(range_server.url()), package, connections=1)
+    checkpoint = json.loads(package.with_name("package.zip.checkpoint").read_text())
+    completed = sum(end - start for start, end in checkpoint["done"])
+    assert completed >= 2 * SEGMENT_SIZE
+
+    sent = range_server.bytes_sent
+    stats: Dict[str, Any] = {}
+    olive2022._fetch_vmnetx(
+        URL(range_server.url()), package, connections=1, stats=stats
+    )
+
+    assert package.read_bytes() == package_data
+    # completed segments are not fetched again
+    assert range_server.bytes_sent - sent == len(package_data) - completed
+    assert stats["bytes_read"] == len(package_data) - completed
+
+
+def test_fetch_restarts_when_package_changed(
+    range_server: RangeServer, package_data: bytes, tmp_path: Path
+) -> None:
+    package = tmp_path / "package.zip"
+    range_server.fail_after = SEGMENT_SIZE // 2
+    with pytest.raises((OSError, HTTPException)):
+        olive2022._fetch_vmnetx(URL(range_server.url()), package, connections=1)
+
+    range_server.data = package_data[::-1]
+    olive2022._fetch_vmnetx(URL(range_server.url()), package, connections=1)
+    assert package.read_bytes() == package_data[::-1]
+
+
+def test_cache_keeps_pinned_packages(
+    range_server: RangeServer,
+    package_data: bytes,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    cache_dir = tmp_path / "olive2022" / "packages"
+    cache_dir.mkdir(parents=True)
+    # packages of other conversions, the oldest one is still in use
+    in_use, unused = cache_dir / "in-use.zip", cache_dir / "unused.zip"
+    for age, package in enumerate([unused, in_use], 1):
+        package.write_bytes(bytes(len(package_data)))
+        os.utime(package, (1000 - age, 1000 - age))
+    pins = olive2022._PackagePins()
+    pins.pin(in_use)
+
+    url = URL(range_server.url())
+    package = olive2022._fetch_cached_vmnetx(
+        url, olive2022.vmnetx_url_to_uuid(url), 2, 2 * len(package_data), pins
+    )
+
+    assert package.read_bytes() == package_data
+    assert in_use.exists() and not unused.exists()
+
+
+def test_fetch_cached_unchanged(
+    range_server: RangeServer,
+    package_data: bytes,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    url = URL(range_server.url())
+    sinfonia_uuid = olive2022.vmnetx_url_to_uuid(url)
+
+    stats: Dict[str, Any] = {}
+    olive2022._fetch_cached_vmnetx(url, sinfonia_uuid, 2, stats=stats)
+    assert stats["bytes_read"] == len(package_data)
+
+    # revalidated with a conditional request, nothing is transferred
+    sent = range_server.bytes_sent
+    package = olive2022._fetch_cached_vmnetx(url, sinfonia_uuid, 2, stats=stats)
+    assert package.read_bytes() == package_data
+    assert stats["bytes_read"] == 0
+    assert range_server.bytes_sent == sent
@@ -0,0 +1,40 @@
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+from pathlib import Path
+from typing import Iterator
+from zipfile import BadZipFile
+
+import pytest
+from packages import disk_image, make_package
+from rangeserver import RangeServer
+from yarl import URL
+
+import olive2022
+
+
+@pytest.fixture
+def package_server(tmp_path: Path, plain_http: None) -> Iterator[RangeServer]:
+    package = make_package(tmp_path / "package.zip", disk_image(4 * 1024 * 1024))
+    with RangeServer(package.read_bytes()) as server:
+        yield server
+
+
+def test_remote_zipfile_reads_metadata_only(package_server: RangeServer) -> None:
+    with olive2022._open_remote_zipfile(URL(package_server.url())) as zipfile:
+        assert b"Test VM" in zipfile.read("vmnetx-package.xml")
+        assert olive2022._parse_domain_xml(zipfile.read("domain.xml")) == (2, 1024)
+        assert zipfile.getinfo("disk.img").file_size == 4 * 1024 * 1024
+
+    assert package_server.bytes_sent < len(package_server.data) // 4
+
+
+def test_remote_zipfile_requires_partial_content(
+    package_server: RangeServer,
+) -> None:
+    package_server.ignore_ranges = True
+    with pytest.raises(BadZipFile) as excinfo:
+        olive2022._open_remote_zipfile(URL(package_server.url()))
+    assert "ignored range request" in str(excinfo.value.__context__)
@@ -0,0 +1,122 @@
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+import hashlib
+import json
+import os
+from argparse import Namespace
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+import pytest
+from registry import Registry
+
+import olive2022
+
+
+@pytest.fixture
+def registry(
+    plain_http: None, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> Iterator[Registry]:
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    with Registry() as server:
+        yield server
+
+
+@pytest.fixture
+def disk_qcow(tmp_path: Path) -> Path:
+    disk_qcow = tmp_path / "disk.qcow2"
+    disk_qcow.write_bytes(os.urandom(3 * 1024 * 1024))
+    return disk_qcow
+
+
+ARGS = Namespace(
+    layer_format="tar",
+    layer_compression="none",
+    threads=2,
+    deploy_token=None,
+    registry="registry.example/olive",
+    mirror=[],
+)
+
+
+def file_digest(path: Path) -> str:
+    return "sha256:" + hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def build(tmpdir: Path, disk_qcow: Path, docker_tags: List[str]) -> Dict[str, Any]:
+    report: Dict[str, Any] = {}
+    tmpdir.mkdir()
+    oci_layout = olive2022._create_oci_layout(
+        ARGS, tmpdir, disk_qcow, "Test VM", report, docker_tags
+    )
+    index = json.loads((oci_layout / "index.json").read_text())
+    return dict(
+        report["layers"],
+        digest=index["manifests"][0]["digest"],
+        blobs=len(list((oci_layout / "blobs" / "sha256").iterdir())),
+    )
+
+
+def test_layer_cache(tmp_path: Path, registry: Registry, disk_qcow: Path) -> None:
+    docker_tags = [f"{registry.host}/olive/image:latest"]
+    first = build(tmp_path / "first", disk_qcow, docker_tags)
+    assert first["cached"] is False and first["blobs"] == 3
+
+    # the layers are found in the cache, but have to be written to be pushed
+    second = build(tmp_path / "second", disk_qcow, docker_tags)
+    assert second["cached"] is False
+    assert second["digest"] == first["digest"]
+
+    olive2022._push_oci_layout(ARGS, tmp_path / "second" / "oci", docker_tags[0])
+
+    # once published, neither the layers are written nor the blobs checked
+    registry.requests.clear()
+    third = build(tmp_path / "third", disk_qcow, docker_tags)
+    assert third["cached"] is True and third["blobs"] == 2
+    assert third["digest"] == first["digest"]
+    assert third["disk_digest"] == first["disk_digest"] == file_digest(disk_qcow)
+    assert [method for method, _ in registry.requests] == ["HEAD"]
+    assert olive2022._push_oci_layout(ARGS, tmp_path / "third" / "oci", docker_tags[0])[
+        "published"
+    ]
+
+    # a mirror that does not have the image needs the layer blobs
+    mirror_tags = docker_tags + [f"{registry.host}/olive/mirror:latest"]
+    fourth = build(tmp_path / "fourth", disk_qcow, mirror_tags)
+    assert fourth["cached"] is False and fourth["blobs"] == 3
+
+
+def test_layer_cache_unchanged_stat(
+    tmp_path: Path, registry: Registry, disk_qcow: Path
+) -> None:
+    docker_tags = [f"{registry.host}/olive/image:latest"]
+    build(tmp_path / "first", disk_qcow, docker_tags)
+    olive2022._push_oci_layout(ARGS, tmp_path / "first" / "oci", docker_tags[0])
+
+    # the cache entry is found by path, size, mtime and inode, so content
+    # that changed behind its back shows the image is not read again
+    stat = disk_qcow.stat()
+    with disk_qcow.open("r+b") as image:
+        image.write(b"changed")
+    os.utime(disk_qcow, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    second = build(tmp_path / "second", disk_qcow, docker_tags)
+    assert second["cached"] is True
+    assert second["disk_digest"] != file_digest(disk_qcow)
+
+
+def test_layer_cache_changed_image(
+    tmp_path: Path, registry: Registry, disk_qcow: Path
+) -> None:
+    first = build(tmp_path / "first", disk_qcow, [])
+    stat = disk_qcow.stat()
+    with disk_qcow.open("r+b") as image:
+        image.write(b"changed")
+    os.utime(disk_qcow, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    second = build(tmp_path / "second", disk_qcow, [])
+    assert second["cached"] is False
+    assert second["digest"] != first["digest"]
+    assert second["disk_digest"] == file_digest(disk_qcow)
@@ -0,0 +1,39 @@
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+import sys
+from pathlib import Path
+from typing import List
+
+import pytest
+
+import olive2022
+
+
+@pytest.mark.parametrize(
+    "command",
+    [
+        ["convert", "vmnetx+https://olivearchive.example/test.vmnetx"],
+        ["convert-batch", "manifest.txt"],
+    ],
+)
+def test_zstd_needs_zstandard(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+    command: List[str],
+) -> None:
+    """Missing zstd support is reported before any image is converted."""
+    monkeypatch.setattr(olive2022, "HAVE_ZSTANDARD", False)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(
+        sys, "argv", ["olive2022", command[0], "--layer-compression=zstd", command[1]]
+    )
+
+    with pytest.raises(SystemExit) as exc_info:
+        olive2022.main()
+    assert exc_info.value.code == 2
+    assert "requires the zstandard package" in capsys.readouterr().err
+    assert not (tmp_path / "RECIPES").exists()
@@ -0,0 +1,48 @@
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+import argparse
+from argparse import Namespace
+from pathlib import Path
+
+import pytest
+
+import olive2022
+
+PACKAGE_XML = b'<image name="Some VM" />'
+
+
+@pytest.mark.parametrize(
+    "key",
+    [
+        "https://olivearchive.example/test.vmnetx",
+        "vmnetx+https://olivearchive.example/test.vmnetx",
+        "UUID",
+    ],
+)
+def test_policy_names(tmp_path: Path, key: str) -> None:
+    url = olive2022.URL("vmnetx+https://olivearchive.example/test.vmnetx")
+    if key == "UUID":
+        key = str(olive2022.vmnetx_url_to_uuid(url)).upper()
+    policy_file = tmp_path / "policy.yaml"
+    policy_file.write_text(f"names:\n  {key}: Policy Name\n")
+
+    args = Namespace(
+        policy=olive2022._policy_file(str(policy_file)),
+        headless=True,
+        deploy_token=None,
+    )
+    policy = olive2022._Policy(args)
+    for spelling in (url, url.with_scheme("https")):
+        assert policy.vmi_name(spelling, PACKAGE_XML) == "Policy Name"
+    other = olive2022.URL("https://olivearchive.example/other.vmnetx")
+    assert policy.vmi_name(other, PACKAGE_XML) == "Some VM"
+
+
+def test_policy_invalid_name_key(tmp_path: Path) -> None:
+    policy_file = tmp_path / "policy.yaml"
+    policy_file.write_text("names:\n  'http://[::1': Name\n")
+    with pytest.raises(argparse.ArgumentTypeError):
+        olive2022._policy_file(str(policy_file))
@@ -0,0 +1,165 @@
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+import os
+import struct
+import zlib
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Tuple
+
+import pytest
+
+import olive2022
+
+CLUSTER = olive2022.QCOW2_CLUSTER_SIZE
+L2_ENTRIES = CLUSTER // 8
+MiB = 1024 * 1024
+
+
+def check_qcow2(disk_qcow: Path, raw: BinaryIO, size: int) -> Dict[str, int]:
+    """Check a qcow2 image the way `qemu-img check` and `qemu-img compare` do.
+    Every guest cluster is compared against the raw image, refcounts are
+    recomputed from the metadata and compared against the refcount blocks and
+    the COPIED flags are checked against the recomputed refcounts.
+    """
+    image = disk_qcow.read_bytes()
+    header = olive2022.QCOW2_HEADER.unpack_from(image)
+    (magic, version, _, _, cluster_bits, virtual_size, crypt_method) = header[:7]
+    (l1_size, l1_offset, refcount_table_offset, refcount_table_clusters) = header[7:11]
+    (nb_snapshots, _, incompatible, _, _, refcount_order, header_length) = header[11:]
+    assert (magic, version, cluster_bits) == (b"QFI\xfb", 3, 16)
+    assert (virtual_size, crypt_method, nb_snapshots, incompatible) == (size, 0, 0, 0)
+    assert (refcount_order, header_length) == (4, olive2022.QCOW2_HEADER.size)
+    assert image[header_length : header_length + 8] == bytes(8)
+
+    guest_clusters = -(-size // CLUSTER)
+    assert l1_size == -(-guest_clusters // L2_ENTRIES)
+    assert l1_offset % CLUSTER == 0 and refcount_table_offset % CLUSTER == 0
+
+    refcounts = [0] * -(-len(image) // CLUSTER)
+    copied: List[Tuple[int, bool]] = []
+
+    def ref(offset: int, length: int) -> None:
+        assert offset + length <= len(image), "reference beyond end of image"
+        for cluster in range(offset // CLUSTER, (offset + length - 1) // CLUSTER + 1):
+            refcounts[cluster] += 1
+
+    ref(0, CLUSTER)
+    ref(l1_offset, l1_size * 8)
+    ref(refcount_table_offset, refcount_table_clusters * CLUSTER)
+
+    csize_mask = (1 << (cluster_bits - 8)) - 1
+    coffset_mask = (1 << olive2022.QCOW2_CSIZE_SHIFT) - 1
+    stats = dict(compressed_clusters=0, uncompressed_clusters=0, zero_clusters=0)
+
+    l1_table = struct.unpack_from(f">{l1_size}Q", image, l1_offset)
+    for l1_index, l1_entry in enumerate(l1_table):
+        l2_offset = l1_entry & olive2022.QCOW2_L2_OFFSET_MASK
+        l2_table = [0] * L2_ENTRIES
+        if l2_offset:
+            assert l2_offset % CLUSTER == 0
+            ref(l2_offset, CLUSTER)
+            copied.append((l2_offset, bool(l1_entry & olive2022.QCOW2_OFLAG_COPIED)))
+            l2_table = list(struct.unpack_from(f">{L2_ENTRIES}Q", image, l2_offset))
+
+        for l2_index, l2_entry in enumerate(l2_table):
+            guest_cluster = l1_index * L2_ENTRIES + l2_index
+            if guest_cluster >= guest_clusters:
+                assert not l2_entry, "mapping beyond the virtual size"
+                continue
+
+            length = min(CLUSTER, size - guest_cluster * CLUSTER)
+            raw.seek(guest_cluster * CLUSTER)
+            expected = raw.read(length)
+
+            if l2_entry & olive2022.QCOW2_OFLAG_COMPRESSED:
+                assert not l2_entry & olive2022.QCOW2_OFLAG_COPIED
+                offset = l2_entry & coffset_mask
+                sectors = (l2_entry >> olive2022.QCOW2_CSIZE_SHIFT) & csize_mask
+                length_on_disk = (sectors + 1) * 512 - offset % 512
+                length_on_disk = min(length_on_disk, len(image) - offset)
+                ref(offset, length_on_disk)
+                # qemu inflates with a 4KiB window and ignores trailing bytes
+                decompressor = zlib.decompressobj(-12)
+                data = decompressor.decompress(
+                    image[offset : offset + length_on_disk], CLUSTER
+                )
+                assert len(data) == CLUSTER
+                stats["compressed_clusters"] += 1
+            elif l2_entry:
+                offset = l2_entry & olive2022.QCOW2_L2_OFFSET_MASK
+                assert offset % CLUSTER == 0 and not l2_entry & 1
+                ref(offset, CLUSTER)
+                copied.append((offset, bool(l2_entry & olive2022.QCOW2_OFLAG_COPIED)))
+                data = image[offset : offset + CLUSTER]
+                stats["uncompressed_clusters"] += 1
+            else:
+                data = bytes(CLUSTER)
+                stats["zero_clusters"] += 1
+
+            assert data[:length] == expected, f"guest cluster {guest_cluster}"
+
+    refcount_block_entries = CLUSTER * 8 >> refcount_order
+    refcount_table = struct.unpack_from(
+        f">{refcount_table_clusters * L2_ENTRIES}Q", image, refcount_table_offset
+    )
+    for block_offset in refcount_table:
+        if block_offset:
+            assert block_offset % CLUSTER == 0
+            ref(block_offset, CLUSTER)
+
+    blocks = -(-len(refcounts) // refcount_block_entries)
+    assert not any(refcount_table[blocks:]), "refcount blocks beyond end of image"
+    stored: List[int] = []
+    for block_offset in refcount_table[:blocks]:
+        if block_offset:
+            stored.extend(
+                struct.unpack_from(f">{refcount_block_entries}H", image, block_offset)
+            )
+        else:
+            stored.extend([0] * refcount_block_entries)
+    refcounts += [0] * (len(stored) - len(refcounts))
+    leaked = [i for i, (a, b) in enumerate(zip(stored, refcounts)) if a != b]
+    assert not leaked, f"refcount mismatch for clusters {leaked[:10]}"
+
+    for offset, flag in copied:
+        assert flag == (refcounts[offset // CLUSTER] == 1), f"COPIED at {offset}"
+    return stats
+
+
+def raw_disk(path: Path, size: int) -> None:
+    """Create a sparse raw disk with compressible, incompressible and zero
+    clusters at the start, across the first L2 table boundary and at the end."""
+    data = b"hello world " * 10000 + os.urandom(2 * CLUSTER + 1234) + bytes(CLUSTER)
+    data += b"x"
+    offsets = [0, L2_ENTRIES * CLUSTER - 3 * CLUSTER // 2, size - len(data)]
+    with path.open("wb") as raw:
+        raw.truncate(size)
+        for offset in offsets:
+            if offset + len(data) <= size:
+                raw.seek(offset)
+                raw.write(data)
+
+
+@pytest.mark.parametrize(
+    "size",
+    [
+        pytest.param(4 * MiB + 512, id="small"),
+        pytest.param(L2_ENTRIES * CLUSTER + 3 * MiB + 4096, id="l2-boundary"),
+    ],
+)
+def test_native_qcow2(tmp_path: Path, size: int) -> None:
+    raw_path = tmp_path / "disk.img"
+    disk_qcow = tmp_path / "disk.qcow2"
+    raw_disk(raw_path, size)
+
+    with raw_path.open("rb") as raw:
+        stats = olive2022._write_qcow2(raw, size, disk_qcow, threads=2)
+        raw.seek(0)
+        checked = check_qcow2(disk_qcow, raw, size)
+
+    assert checked["compressed_clusters"] == stats["compressed_clusters"] > 0
+    assert checked["uncompressed_clusters"] == stats["uncompressed_clusters"] > 0
+    assert checked["zero_clusters"] == stats["zero_clusters"] > 0
@@ -0,0 +1,217 @@
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+import json
+import os
+from argparse import Namespace
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+from urllib.parse import unquote
+
+import pytest
+from registry import Registry
+
+import olive2022
+
+CHUNK = 64 * 1024
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    monkeypatch.setattr(olive2022, "REGISTRY_CHUNK_SIZE", CHUNK)
+    monkeypatch.setattr(olive2022, "sleep", lambda seconds: None)
+    # do not pick up credentials from 'docker login'
+    monkeypatch.setenv("HOME", str(tmp_path))
+
+
+@pytest.fixture
+def registry(request: pytest.FixtureRequest, plain_http: None) -> Iterator[Registry]:
+    with Registry(auth=getattr(request, "param", None)) as server:
+        yield server
+
+
+@pytest.fixture
+def oci_layout(tmp_path: Path) -> Path:
+    oci_layout = tmp_path / "oci"
+    (oci_layout / "blobs" / "sha256").mkdir(parents=True)
+    config = olive2022._oci_write_blob(
+        oci_layout, "application/vnd.oci.image.config.v1+json", b"{}"
+    )
+    layers = [
+        olive2022._oci_write_blob(
+            oci_layout, "application/vnd.oci.image.layer.v1.tar", data
+        )
+        for data in (os.urandom(5 * CHUNK + 123), b"small layer")
+    ]
+    image_manifest = dict(schemaVersion=2, config=config, layers=layers)
+    manifest = olive2022._oci_write_blob(
+        oci_layout,
+        olive2022.OCI_MANIFEST_MEDIA_TYPE,
+        json.dumps(image_manifest).encode(),
+    )
+    (oci_layout / "index.json").write_text(
+        json.dumps(dict(schemaVersion=2, manifests=[manifest]))
+    )
+    return oci_layout
+
+
+def push(
+    oci_layout: Path,
+    registry: Registry,
+    repository: str = "olive/image",
+    mount_from: Optional[str] = None,
+    deploy_token: Optional[str] = "user:secret",
+) -> Dict[str, Any]:
+    args = Namespace(
+        deploy_token=deploy_token, registry=f"{registry.host}/olive", mirror=[]
+    )
+    docker_tag = f"{registry.host}/{repository}:latest"
+    return olive2022._push_oci_layout(args, oci_layout, docker_tag, mount_from)
+
+
+def blob(oci_layout: Path, digest: str) -> bytes:
+    return (oci_layout / "blobs" / "sha256" / digest.split(":", 1)[1]).read_bytes()
+
+
+def image_blobs(oci_layout: Path) -> Dict[str, bytes]:
+    index = json.loads((oci_layout / "index.json").read_text())
+    manifest = json.loads(blob(oci_layout, index["manifests"][0]["digest"]))
+    return {
+        descriptor["digest"]: blob(oci_layout, descriptor["digest"])
+        for descriptor in [manifest["config"]] + manifest["layers"]
+    }
+
+
+@pytest.mark.parametrize("registry", [None, "basic", "bearer"], indirect=True)
+def test_push(oci_layout: Path, registry: Registry) -> None:
+    stats = push(oci_layout, registry)
+
+    blobs = image_blobs(oci_layout)
+    assert stats["published"] is False
+    assert stats["uploaded"] == sum(len(data) for data in blobs.values())
+    for digest, data in blobs.items():
+        assert registry.blobs["olive/image", digest] == data
+
+    media_type, manifest = registry.manifests["olive/image", "latest"]
+    assert media_type == olive2022.OCI_MANIFEST_MEDIA_TYPE
+    assert manifest == blob(oci_layout, stats["digest"])
+    if registry.auth == "bearer":
+        assert ("GET", "/token") in [
+            (method, path.split("?")[0]) for method, path in registry.requests
+        ]
+
+    # the second push only checks the manifest
+    registry.requests.clear()
+    stats = push(oci_layout, registry)
+    assert stats["published"] is True
+    assert {method for method, _ in registry.requests} <= {"HEAD", "GET"}
+    assert all(
+        "/manifests/" in path for method, path in registry.requests if method == "HEAD"
+    )
+
+
+@pytest.mark.parametrize("registry", ["basic", "bearer"], indirect=True)
+def test_push_bad_credentials(oci_layout: Path, registry: Registry) -> None:
+    with pytest.raises(OSError):
+        push(oci_layout, registry, deploy_token="user:wrong")
+    assert not registry.blobs and not registry.manifests
+
+
+def test_push_existing_blobs(oci_layout: Path, registry: Registry) -> None:
+    blobs = image_blobs(oci_layout)
+    digest, data = max(blobs.items(), key=lambda item: len(item[1]))
+    registry.blobs["olive/image", digest] = data
+
+    stats = push(oci_layout, registry)
+
+    assert stats["existing"] == 1
+    assert stats["uploaded"] == sum(len(data) for data in blobs.values()) - len(data)
+    uploaded = [unquote(path) for method, path in registry.requests if method == "PUT"]
+    assert not [path for path in uploaded if digest in path]
+
+
+def test_push_mount(oci_layout: Path, registry: Registry) -> None:
+    push(oci_layout, registry)
+    stats = push(oci_layout, registry, "olive/mirror", mount_from="olive/image")
+
+    assert stats["mounted"] == len(image_blobs(oci_layout))
+    assert stats["uploaded"] == 0
+    assert ("olive/mirror", "latest") in registry.manifests
+
+
+def test_push_resume(oci_layout: Path, registry: Registry) -> None:
+    registry.fail_patch = 2
+
+    stats = push(oci_layout, registry)
+
+    for digest, data in image_blobs(oci_layout).items():
+        assert registry.blobs["olive/image", digest] == data
+    assert ("olive/image", stats["digest"]) in registry.manifests
+    # the upload continued where the registry said it was
+    assert registry.bytes_received < stats["uploaded"] + CHUNK
+    upload_checks = [
+        path
+        for method, path in registry.requests
+        if method == "GET" and "/uploads/" in path
+    ]
+    assert len(upload_checks) == 1
+    assert not registry.uploads
+
+
+@pytest.mark.parametrize("registry", ["basic"], indirect=True)
+@pytest.mark.parametrize("config_key", ["credsStore", "credHelpers"])
+def test_push_credential_helper(
+    oci_layout: Path,
+    registry: Registry,
+    config_key: str,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    helper = tmp_path / "bin" / "docker-credential-test"
+    helper.parent.mkdir()
+    helper.write_text(
+        "#!/bin/sh\n"
+        f'[ "$1" = get ] && [ "$(cat)" = "{registry.host}" ] || exit 1\n'
+        'echo \'{"ServerURL": "", "Username": "user", "Secret": "secret"}\'\n'
+    )
+    helper.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{helper.parent}{os.pathsep}{os.environ['PATH']}")
+
+    docker_config = tmp_path / ".docker" / "config.json"
+    docker_config.parent.mkdir()
+    config: Dict[str, Any] = dict(auths={registry.host: {}})
+    if config_key == "credsStore":
+        config["credsStore"] = "test"
+    else:
+        config["credHelpers"] = {registry.host: "test"}
+    docker_config.write_text(json.dumps(config))
+
+    stats = push(oci_layout, registry, deploy_token=None)
+    assert ("olive/image", stats["digest"]) in registry.manifests
+
+
+def test_publish_mirror_credentials(oci_layout: Path, plain_http: None) -> None:
+    with Registry(auth="basic") as registry, Registry(
+        auth="bearer", credentials="mirror:token"
+    ) as mirror:
+        args = Namespace(
+            deploy_token="user:secret",
+            registry=f"{registry.host}/olive",
+            mirror=[f"{mirror.host}/olive"],
+        )
+        docker_tags = [
+            f"{registry.host}/olive/image:latest",
+            f"{mirror.host}/olive/image:latest",
+        ]
+        # the deploy token is not sent to the mirror
+        with pytest.raises(OSError):
+            olive2022._publish_oci_layout(args, oci_layout, docker_tags)
+        assert ("olive/image", "latest") in registry.manifests
+        assert not mirror.manifests
+
+        args.mirror = [f"{mirror.host}/olive=mirror:token"]
+        results = olive2022._publish_oci_layout(args, oci_layout, docker_tags)
+        assert results[docker_tags[0]]["published"] is True
+        assert ("olive/image", "latest") in mirror.manifests
@@ -0,0 +1,90 @@
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+import json
+import sys
+from pathlib import Path
+from typing import List
+
+import pytest
+from packages import MiB, disk_image, make_package
+from registry import Registry
+
+import olive2022
+
+URL = "vmnetx+https://olivearchive.example/test.vmnetx"
+
+
+def convert(
+    tmp_path: Path,
+    name: str,
+    package: Path,
+    options: List[str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> str:
+    """Convert a package with a fresh registry, work directory and layer
+    cache and return the digest of the image."""
+    workdir = tmp_path / name
+    workdir.mkdir()
+    monkeypatch.chdir(workdir)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(workdir / "cache"))
+
+    with Registry() as registry:
+        monkeypatch.setattr(
+            sys,
+            "argv",
+            [
+                "olive2022",
+                "convert",
+                "--headless",
+                "--qcow2-writer=native",
+                f"--tmp-dir={workdir / 'tmp'}",
+                f"--staging-dir={workdir}",
+                f"--registry={registry.host}/olive",
+                "--deploy-token=user:secret",
+                "--cache-size=0",
+                *options,
+                URL,
+                str(package),
+            ],
+        )
+        assert olive2022.main() == 0
+
+        uuid = olive2022.vmnetx_url_to_uuid(olive2022.URL(URL))
+        report = json.loads(Path("RECIPES", f"{uuid}.report.json").read_text())
+        digest: str = report["image_digest"]
+        # the package is local, nothing was fetched
+        assert report["stages"]["fetch"]["bytes_in"] == 0
+        assert report["stages"]["fetch"]["throughput"] is None
+        _, manifest = registry.manifests["olive/" + str(uuid), "latest"]
+        assert registry.manifests["olive/" + str(uuid), digest][1] == manifest
+    return digest
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        pytest.param(["--layer-compression=none"], id="tar"),
+        pytest.param(["--layer-compression=gzip"], id="gzip"),
+        pytest.param(["--layer-compression=zstd"], id="zstd"),
+        pytest.param(["--layer-format=estargz"], id="estargz"),
+    ],
+)
+def test_reproducible(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    plain_http: None,
+    options: List[str],
+) -> None:
+    if "--layer-compression=zstd" in options:
+        pytest.importorskip("zstandard")
+    monkeypatch.delenv("SOURCE_DATE_EPOCH", raising=False)
+    monkeypatch.setenv("HOME", str(tmp_path))
+    package = make_package(tmp_path / "package.zip", disk_image(8 * MiB))
+
+    first = convert(tmp_path, "first", package, options, monkeypatch)
+    second = convert(tmp_path, "second", package, options, monkeypatch)
+    assert first.startswith("sha256:")
+    assert first == second
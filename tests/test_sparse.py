@@ -0,0 +1,47 @@
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+import os
+from pathlib import Path
+
+import pytest
+
+import olive2022
+
+BLOCK = olive2022.SPARSE_BLOCK_SIZE
+MiB = 1024 * 1024
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        pytest.param(os.urandom(3 * MiB + 100), id="random"),
+        pytest.param(bytes(5 * MiB), id="zero"),
+        pytest.param(
+            b"".join(
+                os.urandom(BLOCK) if index % 3 else bytes(BLOCK)
+                for index in range(1000)
+            ),
+            id="alternating",
+        ),
+        pytest.param(
+            os.urandom(BLOCK - 10) + bytes(3 * BLOCK) + b"x" + bytes(2 * MiB),
+            id="unaligned-zeros",
+        ),
+    ],
+)
+def test_sparse_file(data: bytes, tmp_path: Path) -> None:
+    path = tmp_path / "disk.img"
+    with olive2022._SparseFile(path) as sparse:
+        for offset in range(0, len(data), 300000):
+            sparse.write(data[offset : offset + 300000])
+
+    assert path.read_bytes() == data
+    zero_blocks = sum(
+        data[offset : offset + BLOCK] == bytes(BLOCK)
+        for offset in range(0, len(data) - BLOCK + 1, BLOCK)
+    )
+    # zero blocks are left as holes, allowing for file system overhead
+    assert path.stat().st_blocks * 512 <= len(data) - zero_blocks * BLOCK + MiB
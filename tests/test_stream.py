@@ -0,0 +1,88 @@
+#
+# Copyright (c) 2022 Carnegie Mellon University
+#
+# SPDX-License-Identifier: MIT
+#
+import io
+from pathlib import Path
+from zipfile import ZIP_DEFLATED, ZIP_STORED, BadZipFile, ZipFile
+
+import pytest
+from packages import DOMAIN_XML, MiB, disk_image, make_package
+from rangeserver import RangeServer
+from yarl import URL
+
+import olive2022
+
+
+class Unseekable(io.RawIOBase):
+    """Output that can not seek, zipfile then writes data descriptors."""
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:  # type: ignore[override]
+        self.buffer += data
+        return len(data)
+
+
+def zip_package(disk: bytes, force_zip64: bool = False) -> bytes:
+    """Deflated package with data descriptors, or with zip64 extra fields."""
+    output = io.BytesIO() if force_zip64 else Unseekable()
+    with ZipFile(output, "w", compression=ZIP_DEFLATED) as package:
+        for name, data in [
+            ("vmnetx-package.xml", b'<image name="Test VM" />'),
+            ("domain.xml", DOMAIN_XML.encode()),
+            ("disk.img", disk),
+        ]:
+            with package.open(name, "w", force_zip64=force_zip64) as member:
+                member.write(data)
+    if isinstance(output, Unseekable):
+        return bytes(output.buffer)
+    return output.getvalue()
+
+
+def stream(tmp_path: Path, data: bytes) -> bytes:
+    (tmp_path / "tmp").mkdir()
+    with RangeServer(data) as server:
+        metadata, disk_img = olive2022._stream_vmnetx(
+            URL(server.url()), tmp_path / "tmp"
+        )
+    assert set(metadata) == {"vmnetx-package.xml", "domain.xml"}
+    assert metadata["domain.xml"] == DOMAIN_XML.encode()
+    return disk_img.read_bytes()
+
+
+@pytest.mark.parametrize("variant", ["deflated", "stored", "zip64", "descriptor"])
+def test_stream(tmp_path: Path, plain_http: None, variant: str) -> None:
+    disk = disk_image(3 * MiB)
+    if variant in ("deflated", "stored"):
+        compress_type = ZIP_STORED if variant == "stored" else ZIP_DEFLATED
+        path = make_package(tmp_path / "package.zip", disk, compress_type=compress_type)
+        package = path.read_bytes()
+    else:
+        package = zip_package(disk, force_zip64=variant == "zip64")
+        flags = ZipFile(io.BytesIO(package)).getinfo("disk.img").flag_bits
+        assert bool(flags & 0x08) == (variant == "descriptor")
+
+    assert stream(tmp_path, package) == disk
+
+
+@pytest.mark.parametrize("corruption", ["crc", "size"])
+def test_stream_corrupted(tmp_path: Path, plain_http: None, corruption: str) -> None:
+    disk = disk_image(3 * MiB)
+    path = make_package(tmp_path / "package.zip", disk, compress_type=ZIP_STORED)
+    package = bytearray(path.read_bytes())
+    if corruption == "crc":
+        # the member data no longer matches the crc in the central directory
+        package[package.index(disk[:64])] ^= 0xFF
+    else:
+        # central directory file header, uncompressed size at offset 24
+        header = package.rindex(b"PK\x01\x02")
+        package[header + 24 : header + 28] = (len(disk) + 1).to_bytes(4, "little")
+
+    with pytest.raises(BadZipFile, match="Bad CRC or size"):
+        stream(tmp_path, bytes(package))